@@ -0,0 +1,134 @@
+'''
+本文件实现了基于asyncio的后台图片下载引擎，可替代多个GetImageSpider线程，
+单个事件循环即可同时维持成千上万个下载连接，适合大量主机响应缓慢或已失效的情况，
+该引擎依赖aiohttp，仅在选择该引擎时才需要安装
+'''
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import config
+import metrics
+import retryqueue
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+class AsyncImageSpider(threading.Thread):
+    '''
+    工作线程类，在线程内部运行事件循环，从任务队列获取url并异步下载图片，
+    对外接口与GetImageSpider一致，由MasterSpider启动和停止
+    '''
+    def __init__(self, ID, get_task_func, save_func, headers, fail_func = None,
+                max_concurrency = None, per_host_concurrency = None, create_writer_func = None,
+                done_func = None):
+        '''
+        Description: 初始化函数
+        Args:
+            ID: 线程ID
+            get_task_func: 从任务队列获取url的函数，队列为空时阻塞，返回None表示队列已关闭且任务都已分发
+            save_func: 保存图片的函数，参数为(url, create_writer_func返回的对象)，返回是否保存成功，
+                    负责关闭该对象，在线程池中执行，不阻塞事件循环
+            headers: 下载请求使用的header
+            fail_func: 记录下载失败的函数，参数为(url, 异常)，在线程池中执行，为None时只记录日志
+            max_concurrency: 同时进行的最大下载数量，默认使用config.async_max_concurrency
+            per_host_concurrency: 同一主机同时进行的最大下载数量，默认使用config.async_per_host_concurrency
+            create_writer_func: 参数为url，返回将数据块写入临时文件的对象，需实现write(chunk)和close(discard)，
+                    write在不是图片或图片过大时抛出retryqueue.DownloadError，数据写入临时文件而不是保存在内存中
+            done_func: 参数为url，每个url处理结束后调用且只调用一次，不论保存成功、失败还是save_func抛出异常
+        '''
+        if aiohttp is None:
+            raise ImportError("asyncio download engine requires aiohttp")
+        threading.Thread.__init__(self)
+        self.ID = ID
+        self.get_task = get_task_func
+        self.save_func = save_func
+        self.headers = headers
+        self.fail_func = fail_func
+        if create_writer_func is None:
+            raise ValueError("Error parameter: create_writer_func")
+        self.create_writer = create_writer_func
+        self.done_func = done_func
+        self.max_concurrency = max_concurrency or config.async_max_concurrency
+        self.per_host_concurrency = per_host_concurrency or config.async_per_host_concurrency
+        self.host_semaphores = {}
+
+    def run(self):
+        logging.info("开启异步下载线程： %d" % (self.ID))
+        asyncio.run(self._main())
+        logging.info("异步下载线程： %d 退出" % (self.ID))
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        #全局并发数由信号量控制，获取任务前先占用名额，从而不会从队列中取出过多任务
+        slots = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit = self.max_concurrency,
+                                        limit_per_host = self.per_host_concurrency)
+        #与线程下载引擎的requests超时一致：只限制连接时间和两次读取之间的间隔，不限制整个下载的时间
+        timeout = aiohttp.ClientTimeout(total = None, sock_connect = config.download_timeout,
+                                        sock_read = config.download_timeout)
+        tasks = set()
+        #不保存响应中的cookie，避免一个主机的cookie被发送给其他主机
+        async with aiohttp.ClientSession(connector = connector, timeout = timeout, headers = self.headers,
+                                        cookie_jar = aiohttp.DummyCookieJar()) as session:
+            while True:
+                await slots.acquire()
+                #任务队列为阻塞接口，放在线程池中调用
+                url = await loop.run_in_executor(None, self.get_task)
+                if url is None:
+                    slots.release()
+                    break
+                task = loop.create_task(self._download_pic(session, url, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+
+    def _get_host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        sem = self.host_semaphores.get(host)
+        if sem is None:
+            sem = asyncio.Semaphore(self.per_host_concurrency)
+            self.host_semaphores[host] = sem
+        return sem
+
+    async def _download_pic(self, session, url, slots):
+        '''
+        Description: 异步下载单张图片，成功后交给save_func保存
+        '''
+        start = time.monotonic()
+        metrics.DOWNLOADS_INFLIGHT.inc()
+        try:
+            async with self._get_host_semaphore(url):
+                async with session.get(url, allow_redirects = True) as img_req:
+                    if img_req.status != 200:
+                        raise retryqueue.DownloadError(retryqueue.classify_http_status(img_req.status),
+                                                        "status code: %d" % (img_req.status))
+                    if (img_req.content_length or 0) > config.download_max_size:
+                        raise retryqueue.DownloadError(retryqueue.FAIL_TOO_LARGE,
+                                                        "图片过大: %d字节" % (img_req.content_length))
+                    #数据块直接写入临时文件，文件头足够时即判断是否为图片，不是图片或过大时立即放弃，
+                    #单个数据块的写入只进入页缓存，不在线程池中执行
+                    writer = self.create_writer(url)
+                    try:
+                        async for chunk in img_req.content.iter_chunked(config.download_chunk_size):
+                            writer.write(chunk)
+                    except BaseException:
+                        writer.close(True)
+                        raise
+            if await asyncio.get_running_loop().run_in_executor(None, self.save_func, url, writer):
+                metrics.DOWNLOAD_SECONDS.observe(time.monotonic() - start)
+        except Exception as e:
+            if self.fail_func is None:
+                logging.error(u'%s  %s请求出错:%s' % (time.ctime(), url, e))
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, self.fail_func, url, e)
+        finally:
+            metrics.DOWNLOADS_INFLIGHT.dec()
+            slots.release()
+            if self.done_func is not None:
+                self.done_func(url)
@@ -10,6 +10,9 @@ import time
 
 #懒加载模式实现
 class BaiduSpiderWebLazy(BaseSpiderWeb):
+    #原图URL保存在每张图片的data-objurl属性中
+    original_url_rules = [(".imgitem", "data-objurl")]
+
     def __init__(self, put_url_2_queue_func, get_img_func = None, dev_mode = True,
                 keywrods = ""):
         BaseSpiderWeb.__init__(self, "baidu", "https://image.baidu.com/",
@@ -49,31 +52,13 @@ class BaiduSpiderWebLazy(BaseSpiderWeb):
         #每次滚动1500像素
         js="window.scrollBy(0, 1500)"
         img_page_count = 0
-        #TODO:是否有更好的方式确定所有内容已经加载完成
         while True:
             self.driver.execute_script(js)
-            time.sleep(5)
-            image_items = self.driver.find_elements_by_class_name("imgpage")
-            if len(image_items) <= img_page_count:
+            #新的一页图片出现或网络静止后继续
+            count = self.wait_for_load(".imgpage", img_page_count)
+            if count <= img_page_count:
                 break
-            img_page_count = len(image_items)
-
-    def get_original_urls_this_page(self):
-        '''
-        Description: 百度可直接从搜索的主页面获取原图URL
-        Returns: 
-            url: 从新页面上获取到的一张原图片的URL
-            None: 未获取到图片URL
-        '''
-        try:
-            img_items = self.driver.find_elements_by_class_name("imgitem")
-        except exception.NoSuchElementException as e:
-            logging.error("%s, 找不到该元素:%s" % (self.name, e))
-            return None  	
-        if img_items is None:
-            logging.error("%s, img_items is None:%s" % (self.name))
-        
-        return [item.get_attribute("data-objurl") for item in img_items]
+            img_page_count = count
 
 #分页模式实现
 class BaiduSpiderWebSplit(BaseSpiderWeb):
@@ -7,20 +7,135 @@
 '''
 import os
 from abc import ABCMeta, abstractmethod
+import copy
+import queue
+import threading
 import time
 import logging
+import re
+import urllib.parse
 from selenium import webdriver
+import selenium.common.exceptions as exception
+
+import config
+import crawlstate
+import httpclient
+import metrics
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+#资源屏蔽配置中各资源类型对应的扩展名，Network.setBlockedURLs只能按URL匹配，因此按扩展名屏蔽，
+#每个扩展名生成"*.ext"和"*.ext?*"两个模式，不使用"*.ext*"，避免屏蔽查询参数中含有图片地址的页面
+_RESOURCE_TYPE_EXTENSIONS = {
+    "font": ["woff", "woff2", "ttf", "otf", "eot"],
+    "stylesheet": ["css"],
+    "media": ["mp4", "webm", "ogg", "mp3", "m3u8", "flv"],
+    "image": ["jpg", "jpeg", "png", "gif", "webp", "bmp", "svg", "ico"],
+}
+
+def _match_url_pattern(url, pattern):
+    '''
+    Description: 按Network.setBlockedURLs的规则匹配URL，只有*为通配符
+    '''
+    return re.fullmatch(".*".join(re.escape(part) for part in pattern.split("*")), url) is not None
+
+def get_blocked_url_patterns(profile):
+    '''
+    Description: 根据资源屏蔽配置生成传给Network.setBlockedURLs的URL模式，会屏蔽allow_urls中任一URL的模式被忽略
+    Args:
+        profile: 资源屏蔽配置字典，见config.block_profile_default
+    Returns:
+        URL模式列表
+    Raises:
+        ValueError: block_resource_types中有不支持的资源类型
+    '''
+    patterns = list(profile.get("block_urls", []))
+    for resource_type in profile.get("block_resource_types", []):
+        if resource_type not in _RESOURCE_TYPE_EXTENSIONS:
+            raise ValueError("Error parameter: block_resource_types, %s" % (resource_type))
+        for ext in _RESOURCE_TYPE_EXTENSIONS[resource_type]:
+            patterns.extend(["*.%s" % (ext), "*.%s?*" % (ext)])
+    allow_urls = profile.get("allow_urls", [])
+    result = []
+    for pattern in patterns:
+        allowed = [url for url in allow_urls if _match_url_pattern(url, pattern)]
+        if allowed:
+            logging.info("屏蔽模式%s会屏蔽允许的URL%s，忽略该模式" % (pattern, allowed[0]))
+        elif pattern not in result:
+            result.append(pattern)
+    return result
+
+#HTTP抓取模式请求结果页面时使用的header
+HTTP_FETCH_HEADERS = {
+        'Accept': 'text/html,application/xhtml+xml,application/json;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'zh-CN,zh;q=0.9',
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '\
+                        '(KHTML, like Gecko) Chrome/69.0.3497.100 Safari/537.36',
+    }
+
+#获取页面加载状态：监视的元素数量、已完成的资源请求数量和文档加载状态，
+#资源计时缓冲区默认只保存250条记录，满后不再增加，因此先扩大缓冲区
+_LOAD_STATE_JS = '''
+if (performance.setResourceTimingBufferSize) {
+    performance.setResourceTimingBufferSize(100000);
+}
+var count = arguments[0] ? document.querySelectorAll(arguments[0]).length : -1;
+return [count, performance.getEntriesByType("resource").length, document.readyState];
+'''
+
+#按规则批量提取元素属性值，每条规则为[CSS选择器, 属性名]，优先读取DOM属性（与WebElement.get_attribute一致，
+#如href、src为绝对URL），没有该DOM属性时读取HTML属性，忽略空值
+_EXTRACT_JS = '''
+var rules = arguments[0];
+var results = [];
+for (var i = 0; i < rules.length; i++) {
+    var values = [];
+    var nodes = document.querySelectorAll(rules[i][0]);
+    for (var j = 0; j < nodes.length; j++) {
+        var node = nodes[j];
+        if (rules[i].length > 2) {
+            node = node.querySelector(rules[i][2]);
+            if (node === null) {
+                continue;
+            }
+        }
+        var value = node[rules[i][1]];
+        if (value === undefined || value === null || typeof value === "object") {
+            value = node.getAttribute(rules[i][1]);
+        }
+        if (value !== null && value !== "") {
+            values.push(String(value));
+        }
+    }
+    results.push(values);
+}
+return results;
+'''
 
 class BaseSpiderWeb(metaclass=ABCMeta):
     '''
     抽象的蜘蛛网类，此类不可实例化，其他实体爬虫网络类需继承该类并
     对必要的方法进行进行重载，加abstractmethod注解的方法是子类必须实现的
     '''
+    #提取页面URL的规则，格式为[(CSS选择器, 属性名), ...]，子类设置后不需要再重载
+    #规则可带第三项子选择器(CSS选择器, 属性名, 子选择器)，此时每个匹配元素只取其中第一个匹配子选择器的元素
+    #get_original_urls_this_page或get_abstract_urls_this_page，所有URL通过一次execute_script调用提取
+    original_url_rules = None
+    abstract_url_rules = None
+    #HTTP抓取模式的搜索结果页URL模板，{keywords}替换为编码后的关键词，为None时网站不支持HTTP抓取模式，
+    #可通过config.http_fetch_urls覆盖
+    http_url = None
+    #HTTP抓取模式中下一页链接的规则(CSS选择器, 属性名)，用于默认的parse_page
+    next_page_rule = None
+
     @abstractmethod
     def __init__(self, name, url, load_mode, keywords = None, put_url_2_queue_func = None,
                 get_img_func = None,download_backend = True, dev_mode = False, user_info = None,
                 able_get_original_from_main_page = False, switch_to_split = False,
-                popup = False, image_folder = "."):
+                popup = False, image_folder = ".", fetch_mode = None):
         ''' 
         Description:  初始化函数,抽象方法
         Args:
@@ -50,11 +165,15 @@ class BaseSpiderWeb(metaclass=ABCMeta):
                             split_page或者lazy_split_page
             popup:页面是否会出现弹窗，出现的话，需调用close_popup方法关闭弹窗
             image_folder: 图片保存路径
+            fetch_mode: 获取结果页面的方式，"browser"使用Chrome webdriver，"http"不启动浏览器，直接请求
+                    build_search_url返回的URL并由parse_page解析，为None时网站名称在config.http_fetch_sites中
+                    则使用"http"，否则使用"browser"，需要打开详细页面获取原图URL的网站不能使用"http"
         Notes:
             子类的初始化方法中只需要接受put_url_2_queue_func、get_img_func、dev_mode和keywords参数，以上其他参数类内部
             都是可以定义好的，而不需要外部使用时再传入
         '''
         self.driver = None
+        self.http_session = None        #HTTP抓取模式使用的带连接池的Session
         self.name = name
         self.url = url
         if load_mode not in ["lazy", "split_page", "lazy_split_page"]:
@@ -82,11 +201,30 @@ class BaseSpiderWeb(metaclass=ABCMeta):
                 logging.error("Param user_info error")
                 raise ValueError("Error parameter: user_info")
             self.dev_mode = True
+
+        if fetch_mode is None:
+            fetch_mode = "http" if self.name in config.http_fetch_sites else "browser"
+        if fetch_mode not in ["browser", "http"]:
+            raise ValueError("Error parameter: fetch_mode")
+        if fetch_mode == "http" and (self.user_info or
+                (self.http_url is None and self.name not in config.http_fetch_urls)):
+            raise ValueError("Error parameter: fetch_mode, %s does not support http fetch mode" % (self.name))
+        #HTTP抓取模式没有浏览器，无法打开详细页面获取原图URL
+        if fetch_mode == "http" and not self.able_get_original_from_main_page:
+            raise ValueError("Error parameter: fetch_mode, %s needs detail pages and can't use http fetch mode" % (self.name))
+        self.fetch_mode = fetch_mode
+        self.http_page_url = None       #HTTP抓取模式当前页面的URL
+
         self.options = webdriver.ChromeOptions()    #浏览器选项  
         #self.options.add_experimental_option("excludeSwitches", ["ignore-certificate-errors"])
         #如果某些数据需要从浏览器上下载，则需要提供以下下载选项
         prefs = {'profile.default_content_settings.popups': 0, 'download.default_directory': self.image_folder}
         #prefs = {'profile.default_content_settings.popups': 0}
+        #资源屏蔽配置，禁止加载图片通过浏览器选项设置，其他屏蔽在获取浏览器后通过CDP设置
+        self.block_profile = config.block_profiles.get(self.name, config.block_profile_default) or {}
+        self.blocked_url_patterns = get_blocked_url_patterns(self.block_profile)
+        if self.block_profile.get("images"):
+            prefs['profile.managed_default_content_settings.images'] = 2
         self.options.add_experimental_option('prefs', prefs)
         #非开发模式使用chrome的headless模式
         if not self.dev_mode:
@@ -98,15 +236,16 @@ class BaseSpiderWeb(metaclass=ABCMeta):
         #改变这个属性的状态
         self.last_page = False
 
-        #以下为从中断处抓取功能设计字段, 单纯的lazy模式没必要使用中断功能
-        if not "lazy" == self.load_mode:
-            self.history_url_file_name = "%s-history-page.txt" % (self.name)        #记录爬取历史页面的URL文件名
-            self.last_page_url = None
-            if os.path.isfile(self.history_url_file_name):
-                with open(self.history_url_file_name) as f:
-                    lines = [line.strip() for line in f.readlines()]
-                    if len(lines) > 0:
-                        self.last_page_url = lines[-1]
+        #以下为从中断处抓取功能设计字段, 单纯的lazy模式没必要使用中断功能，
+        #爬取历史页面的URL保存在crawl_state中，由MasterSpider在创建对象后赋值，
+        #为None时保存在"<网站名称>-history-page.txt"文件中，
+        #两种抓取模式保存的页面URL不能通用，HTTP抓取模式使用"<网站名称>-http"单独保存
+        self.crawl_state = None
+        self.last_page_url = None
+        self.last_page_finished = False
+
+        #所有网站共用的WebDriver池，由MasterSpider在创建对象后赋值，为None时由本对象自己启动和关闭浏览器
+        self.driver_pool = None
 
     def __del__(self):
         '''
@@ -121,12 +260,18 @@ class BaseSpiderWeb(metaclass=ABCMeta):
         '''
         logging.info("网站: %s 开始爬取..." % (self.name))
 
-        #历史页面第一个字符为#，说明是网站最后一页，即之前已经爬取完成
-        if not "lazy" == self.load_mode and self.last_page_url[0] == "#":
-            logging.info("网站: %s 所有url之前已经爬取完成，退出" % (self.name))
+        if not "lazy" == self.load_mode:
+            self._load_history_page()
+            #历史页面为网站最后一页，即之前已经爬取完成
+            if self.last_page_finished:
+                logging.info("网站: %s 所有url之前已经爬取完成，退出" % (self.name))
+                return
+
+        if self.fetch_mode == "http":
+            self._start_crawl_http()
             return
 
-        self.driver = webdriver.Chrome(chrome_options=self.options)
+        self.driver = self._create_driver()
         self.driver.get(self.url)
 
         self._close_popup()
@@ -153,6 +298,7 @@ class BaseSpiderWeb(metaclass=ABCMeta):
                 self._close_popup()
 
         while not self.is_last_page():
+            page_start = time.monotonic()
             if self.load_mode == "lazy" or self.load_mode == "lazy_split_page":
                 self.scroll_slider()
 
@@ -164,6 +310,8 @@ class BaseSpiderWeb(metaclass=ABCMeta):
                 logging.error("%s, 当前页面未获取到任何url，退出" % (self.name))
                 return
             self.iterate_all_url(urls)
+            metrics.PAGES_CRAWLED.inc(site = self.name)
+            metrics.PAGE_SECONDS.observe(time.monotonic() - page_start, site = self.name)
 
             #lazy模式只有一页，不必循环
             if self.load_mode == "lazy":
@@ -174,6 +322,103 @@ class BaseSpiderWeb(metaclass=ABCMeta):
         logging.info("网站: %s 所有url爬取完成，退出" % (self.name))
         #self.close_driver()
 
+    def _start_crawl_http(self):
+        '''
+        Description: HTTP抓取模式的爬取循环，与浏览器模式流程相同，每页请求一次并由parse_page解析，
+                翻页前保存下一页的URL，中断后从该页继续爬取
+        '''
+        if self.http_session is None:
+            self.http_session = httpclient.create_session(HTTP_FETCH_HEADERS)
+        if not "lazy" == self.load_mode and self.last_page_url:
+            page_url = self.last_page_url
+        else:
+            page_url = self.build_search_url()
+
+        while not self.is_last_page():
+            page_start = time.monotonic()
+            self.http_page_url = page_url
+            try:
+                response = self.http_session.get(page_url, timeout = config.http_fetch_timeout)
+                response.raise_for_status()
+                urls, next_page_url = self.parse_page(response)
+            except Exception as e:
+                logging.error("%s, 获取页面%s出错: %s，退出" % (self.name, page_url, e))
+                return
+            if urls is None:
+                logging.error("%s, 当前页面未获取到任何url，退出" % (self.name))
+                return
+            self.iterate_all_url(urls)
+            metrics.PAGES_CRAWLED.inc(site = self.name)
+            metrics.PAGE_SECONDS.observe(time.monotonic() - page_start, site = self.name)
+
+            #lazy模式只有一页，不必循环
+            if self.load_mode == "lazy":
+                break
+
+            if next_page_url is None:
+                self.set_last_page()
+            else:
+                self.last_page_url = next_page_url
+                self._write_history_page(next_page_url)
+                page_url = next_page_url
+
+        logging.info("网站: %s 所有url爬取完成，退出" % (self.name))
+
+    def build_search_url(self):
+        '''
+        Description: HTTP抓取模式中生成搜索结果第一页的URL，默认使用config.http_fetch_urls或http_url模板，
+                需要其他参数的网站可重载本方法
+        '''
+        url = config.http_fetch_urls.get(self.name, self.http_url)
+        return url.format(keywords = urllib.parse.quote(self.keywords or ""))
+
+    def parse_page(self, response):
+        '''
+        Description: HTTP抓取模式中解析结果页面，默认按original_url_rules和next_page_rule解析HTML，
+                返回JSON等其他格式的网站需重载本方法
+        Args:
+            response: requests.Response对象
+        Returns:
+            (urls, next_page_url): urls与get_original_urls_this_page的返回值相同，没有下一页时next_page_url为None
+        '''
+        soup = self.parse_html(response.text)
+        urls = self.select_urls(soup, self.original_url_rules, response.url)
+        next_page_url = None
+        if self.next_page_rule is not None:
+            next_urls = self.select_urls(soup, [self.next_page_rule], response.url)
+            next_page_url = next_urls[0] if next_urls else None
+        return urls, next_page_url
+
+    def parse_html(self, text):
+        if BeautifulSoup is None:
+            raise ImportError("HTTP fetch mode requires beautifulsoup4")
+        return BeautifulSoup(text, "html.parser")
+
+    def select_urls(self, soup, rules, base_url):
+        '''
+        Description: 按与extract_urls相同的规则从解析后的HTML中提取URL，相对URL转换为绝对URL
+        Returns:
+            urls: 提取到的URL列表
+            None: 未提取到任何URL
+        '''
+        urls = []
+        seen = set()
+        for rule in rules:
+            selector, attr = rule[0], rule[1]
+            for tag in soup.select(selector):
+                if len(rule) > 2:
+                    tag = tag.select_one(rule[2])
+                    if tag is None:
+                        continue
+                url = tag.get(attr)
+                if not url:
+                    continue
+                url = urllib.parse.urljoin(base_url, url)
+                if url not in seen:
+                    seen.add(url)
+                    urls.append(url)
+        return urls or None
+
     def iterate_all_url(self, urls):
         '''
         Description: 迭代传入的URL列表，根据self.get_original_from_asbstract
@@ -183,30 +428,194 @@ class BaseSpiderWeb(metaclass=ABCMeta):
         '''
         if urls is None:
             return
+        if not self.able_get_original_from_main_page and self.resolve_detail_pages_parallel(urls):
+            return
 
         for url in urls:
             if self.able_get_original_from_main_page:
                 orig_url = url
             else:
-                orig_url = self.get_original_img_url(url)
+                orig_url = self.resolve_detail_page(url)
             
             if orig_url is None:
                 logging.error("%s, 当前缩略页面%s页面对应的原图url为None" % (self.name, url))
                 continue
+            self.deliver_urls(orig_url)
+
+    def deliver_urls(self, orig_urls, cookies = None):
+        '''
+        Description: 将原图URL交给后台下载或直接下载
+        Args:
+            orig_urls: 一个原图URL或原图URL列表
+            cookies: 直接下载时使用的cookie
+        '''
+        if isinstance(orig_urls, str):
+            orig_urls = [orig_urls]
+        for orig_url in orig_urls:
             if self.download_backend:
                 #将图片url传给后台下载
                 self.put_url_2_queue_func(orig_url)
             else:
                 #直接下载图片
-                self.get_img(orig_url)
+                self.get_img(orig_url, cookies)
+
+    def resolve_detail_page(self, url):
+        '''
+        Description: 从缩略图链接获取原图URL，默认调用get_original_img_url，并行解析时在工作浏览器中调用，
+                需要先打开详细页面的网站可重载本方法
+        Returns:
+            一个原图URL或原图URL列表，未获取到时返回None
+        '''
+        return self.get_original_img_url(url)
+
+    def resolve_detail_pages_parallel(self, urls):
+        '''
+        Description: 使用config.detail_page_workers个工作浏览器并行打开详细页面获取原图URL，
+                工作浏览器从WebDriver池中获取，第一个最多等待config.detail_page_acquire_timeout秒，
+                其余的只使用池中立即可用的浏览器，避免各网站互相等待对方归还浏览器而死锁，
+                工作浏览器使用与当前浏览器相同的cookie，获取到的原图URL按deliver_urls交给后台下载或直接下载
+        Returns:
+            True: 已并行处理完所有URL，False: 未启用并行或没有获取到工作浏览器，应由调用者依次处理
+        '''
+        worker_num = min(config.detail_page_workers, len(urls))
+        if worker_num <= 1:
+            return False
+        drivers = self._acquire_worker_drivers(worker_num)
+        if not drivers:
+            logging.info("%s, 没有可用的工作浏览器，依次打开详细页面" % (self.name))
+            return False
+        cookies = self.driver.get_cookies()
+        url_queue = queue.Queue()
+        for url in urls:
+            url_queue.put(url)
+        workers = [threading.Thread(target = self._detail_page_worker, args = (driver, cookies, url_queue),
+                                    daemon = True) for driver in drivers]
+        try:
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            for driver in drivers:
+                self._release_worker_driver(driver)
+        return True
+
+    def _acquire_worker_drivers(self, worker_num):
+        drivers = []
+        for i in range(worker_num):
+            try:
+                if self.driver_pool is not None:
+                    driver = self.driver_pool.acquire(self.options,
+                                                    timeout = config.detail_page_acquire_timeout if i == 0 else 0)
+                else:
+                    driver = webdriver.Chrome(chrome_options=self.options)
+            except Exception as e:
+                logging.error("%s, 启动工作浏览器出错: %s" % (self.name, e))
+                break
+            if driver is None:
+                break
+            self._apply_block_profile(driver)
+            drivers.append(driver)
+        return drivers
+
+    def _release_worker_driver(self, driver):
+        if self.driver_pool is not None:
+            self.driver_pool.release(driver)
+        else:
+            try:
+                driver.quit()
+            except Exception as e:
+                logging.error("%s, 关闭工作浏览器出错: %s" % (self.name, e))
+
+    def _share_cookies(self, driver, cookies):
+        '''
+        Description: 通过CDP将cookie写入工作浏览器，add_cookie只能写入当前页面所在域名的cookie，
+                因此不使用add_cookie
+        '''
+        cdp_cookies = []
+        for cookie in cookies:
+            cdp_cookie = {"name": cookie["name"], "value": cookie["value"], "domain": cookie.get("domain"),
+                            "path": cookie.get("path", "/"), "secure": cookie.get("secure", False),
+                            "httpOnly": cookie.get("httpOnly", False)}
+            if "expiry" in cookie:
+                cdp_cookie["expires"] = cookie["expiry"]
+            if cookie.get("sameSite") in ["Strict", "Lax", "None"]:
+                cdp_cookie["sameSite"] = cookie["sameSite"]
+            cdp_cookies.append(cdp_cookie)
+        if cdp_cookies:
+            driver.execute_cdp_cmd("Network.setCookies", {"cookies": cdp_cookies})
+
+    def _detail_page_worker(self, driver, cookies, url_queue):
+        '''
+        Description: 工作线程，使用浅复制的本对象操作工作浏览器，从而网站类中使用self.driver的方法不需要修改
+        '''
+        worker = copy.copy(self)
+        worker.driver = driver
+        try:
+            try:
+                self._share_cookies(driver, cookies)
+            except Exception as e:
+                logging.error("%s, 工作浏览器设置cookie出错: %s" % (self.name, e))
+            while True:
+                try:
+                    url = url_queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    orig_urls = worker.resolve_detail_page(url)
+                    if not orig_urls:
+                        logging.error("%s, 当前缩略页面%s页面对应的原图url为None" % (self.name, url))
+                        continue
+                    worker.deliver_urls(orig_urls, cookies)
+                except Exception as e:
+                    logging.error("%s : %s" % (self.name, e))
+        finally:
+            #工作浏览器由调用者归还，避免复制的对象销毁时关闭浏览器
+            worker.driver = None
+
+    def get_img(self, url = None, cookies = None):
+        '''
+        Description: 直接下载图片，默认调用get_img_func，需要在浏览器中下载图片的网站需重载本方法
+        '''
+        self.get_img_func(url, cookies)
+
+    def _create_driver(self):
+        '''
+        Description: 获取浏览器，有WebDriver池时从池中获取使用相同选项的浏览器
+        '''
+        if self.driver_pool is not None:
+            driver = self.driver_pool.acquire(self.options)
+        else:
+            driver = webdriver.Chrome(chrome_options=self.options)
+        self._apply_block_profile(driver)
+        return driver
+
+    def _apply_block_profile(self, driver):
+        '''
+        Description: 通过CDP设置浏览器屏蔽的URL模式，WebDriver池中的浏览器归还时会清除该设置
+        '''
+        if not self.blocked_url_patterns:
+            return
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.blocked_url_patterns})
+        except Exception as e:
+            logging.error("%s, 设置屏蔽的URL出错: %s" % (self.name, e))
 
     def close_driver(self):
+        '''
+        Description: 关闭浏览器，浏览器来自WebDriver池时归还给池
+        '''
+        if self.http_session is not None:
+            self.http_session.close()
+            self.http_session = None
         if self.driver is not None:
-            self.driver.close()
-            self.driver.quit()
-
-    # def get_img(self, url = None):
-    #     self.get_img_func(url)
+            driver, self.driver = self.driver, None
+            if self.driver_pool is not None:
+                self.driver_pool.release(driver)
+            else:
+                driver.close()
+                driver.quit()
 
     def scroll_slider(self):
         '''
@@ -214,12 +623,78 @@ class BaseSpiderWeb(metaclass=ABCMeta):
         '''
         #每次滚动1500像素
         js="window.scrollBy(0,1500)"
-        #TODO:是否有更好的方式确定所有内容已经加载完成
         for _ in range(10):
             self.driver.execute_script(js)
             self.click_more_btn()
-            time.sleep(2)
-        time.sleep(2)
+            self.wait_for_load()
+
+    def wait_for_load(self, item_selector = None, last_count = None, timeout = None):
+        '''
+        Description: 滚动页面或点击按钮后等待懒加载的内容，代替固定时间的sleep，以下任一条件满足时返回：
+                item_selector匹配的元素数量与last_count不同，即新内容已出现；
+                页面加载完成并且config.lazy_load_settle_time秒内没有新完成的资源请求，即网络已静止；
+                等待时间超过timeout秒
+        Args:
+            item_selector: 监视数量变化的元素的CSS选择器，为None时只等待网络静止
+            last_count: 滚动前的元素数量，为None时使用本方法开始时的数量
+            timeout: 最长等待时间（秒），默认使用config.lazy_load_timeout
+        Returns:
+            item_selector匹配的元素数量，item_selector为None时返回-1
+        '''
+        timeout = timeout or config.lazy_load_timeout
+        start = time.monotonic()
+        count, resources, _ = self.driver.execute_script(_LOAD_STATE_JS, item_selector)
+        if last_count is None:
+            last_count = count
+        last_change = start
+        while item_selector is None or count == last_count:
+            now = time.monotonic()
+            if now - start >= timeout:
+                logging.info("%s, 等待页面加载超时: %.1f秒" % (self.name, timeout))
+                break
+            time.sleep(config.lazy_load_poll_interval)
+            count, cur_resources, ready_state = self.driver.execute_script(_LOAD_STATE_JS, item_selector)
+            now = time.monotonic()
+            if cur_resources != resources:
+                resources = cur_resources
+                last_change = now
+            elif ready_state == "complete" and now - last_change >= config.lazy_load_settle_time:
+                break
+        return count
+
+    def extract_values(self, rules):
+        '''
+        Description: 在一次execute_script调用中提取页面上所有匹配元素的属性值，
+                代替逐个元素调用find_element和get_attribute，避免每个元素都与chromedriver往返通信
+        Args:
+            rules: 规则列表，每条规则为(CSS选择器, 属性名)或(CSS选择器, 属性名, 子选择器)
+        Returns:
+            与rules一一对应的列表，每个元素为该规则提取到的非空值列表
+        Raises:
+            selenium.common.exceptions.WebDriverException: 选择器无效或页面执行脚本出错
+        '''
+        return self.driver.execute_script(_EXTRACT_JS, [list(rule) for rule in rules])
+
+    def extract_urls(self, rules):
+        '''
+        Description: 按规则提取URL，并按出现顺序合并、去除重复的URL
+        Returns:
+            urls: 提取到的URL列表
+            None: 未提取到任何URL
+        '''
+        try:
+            values_list = self.extract_values(rules)
+        except exception.WebDriverException as e:
+            logging.error("%s, 提取URL出错: %s" % (self.name, e))
+            return None
+        urls = []
+        seen = set()
+        for values in values_list:
+            for url in values:
+                if url not in seen:
+                    seen.add(url)
+                    urls.append(url)
+        return urls or None
 
     def save_history_page_url(self):
         '''
@@ -231,9 +706,31 @@ class BaseSpiderWeb(metaclass=ABCMeta):
             True: 执行成功
             False: 执行失败
         '''
-        self.last_page_url = self.driver.current_url
-        with open(self.history_url_file_name, "w") as f:
-            f.write(self.last_page_url + "\n")
+        self.last_page_url = self._current_page_url()
+        self._write_history_page(self.last_page_url)
+
+    def _load_history_page(self):
+        '''
+        Description: 读取最近一次爬取的页面URL及网站是否已爬取完成
+        '''
+        checkpoint_name = self._checkpoint_name()
+        if self.crawl_state is not None:
+            self.last_page_url, self.last_page_finished = self.crawl_state.get_checkpoint(checkpoint_name)
+        else:
+            self.last_page_url, self.last_page_finished = crawlstate.read_history_page_file(checkpoint_name)
+
+    def _write_history_page(self, page_url, finished = False):
+        checkpoint_name = self._checkpoint_name()
+        if self.crawl_state is not None:
+            self.crawl_state.save_checkpoint(checkpoint_name, page_url, finished)
+        else:
+            crawlstate.write_history_page_file(checkpoint_name, page_url, finished)
+
+    def _checkpoint_name(self):
+        #浏览器模式保存已爬取的页面，HTTP抓取模式保存下一页(Chinaso为JSON接口URL)，两者分开保存
+        if self.fetch_mode == "http":
+            return "%s-http" % (self.name)
+        return self.name
 
     def load_last_page(self):
         '''
@@ -267,9 +764,13 @@ class BaseSpiderWeb(metaclass=ABCMeta):
 
     def set_last_page(self):
         self.last_page = True
-        self.last_page_url = self.driver.current_url
-        with open(self.history_url_file_name, "w") as f:
-            f.write("#" + self.last_page_url + "\n")
+        self.last_page_url = self._current_page_url()
+        self._write_history_page(self.last_page_url, True)
+
+    def _current_page_url(self):
+        if self.fetch_mode == "http":
+            return self.http_page_url
+        return self.driver.current_url
 
 
     def _close_popup(self):
@@ -319,7 +820,8 @@ class BaseSpiderWeb(metaclass=ABCMeta):
             urls: 从当前页面上获取的缩略图URL
             None: 未获取到任何图片URL
         '''
-        assert False, "Can't call this function of BaseSpiderWeb"
+        assert self.abstract_url_rules is not None, "Can't call this function of BaseSpiderWeb"
+        return self.extract_urls(self.abstract_url_rules)
     
     def get_original_urls_this_page(self):
         '''
@@ -328,7 +830,8 @@ class BaseSpiderWeb(metaclass=ABCMeta):
             url: 从新页面上获取到的一张原图片的URL
             None: 未获取到图片URL
         '''
-        assert False, "Can't call this function of BaseSpiderWeb"
+        assert self.original_url_rules is not None, "Can't call this function of BaseSpiderWeb"
+        return self.extract_urls(self.original_url_rules)
 
     #@abstractmethod
     def get_original_img_url(self, url = ""):
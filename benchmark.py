@@ -0,0 +1,184 @@
+'''
+本文件为端到端的下载性能测试，使用benchserver.py中的本地图片服务器和不需要浏览器的模拟网站，
+按worker_num、下载引擎和任务队列参数的组合依次运行MasterSpider，每个组合在独立的子进程和临时目录中运行，
+统计图片数/秒、MB/秒、下载延迟的p50和p99以及进程的峰值内存，结果保存为JSON文件，便于不同版本之间比较，例如：
+    python benchmark.py --images 2000 --workers 1,4,16 --queue-maxsize 100,10000 --latency 0.02 --output bench.json
+'''
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import benchserver
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#统计下载延迟分位数使用的直方图桶上界（秒），按约10%的比例递增
+LATENCY_BUCKETS = tuple(0.001 * (1.1 ** i) for i in range(120))
+
+def make_fake_web(site, urls):
+    '''
+    Description: 创建模拟网站类，爬取时依次将urls放入任务队列，不需要浏览器
+    '''
+    class FakeSpiderWeb():
+        def __init__(self, put_url_2_queue_func, get_img_func, dev_mode = False, image_folder = ".", keywords = None):
+            self.name = site
+            self.download_backend = True
+            self.put_url_2_queue_func = put_url_2_queue_func
+            self.get_img_func = get_img_func
+
+        def start_crawl(self):
+            for url in urls:
+                self.put_url_2_queue_func(url)
+
+    return FakeSpiderWeb
+
+def get_peak_rss_mb():
+    '''
+    Description: 当前进程的峰值内存（MB），平台不支持时返回None
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #macOS上单位为字节，Linux上为KB
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_case(case):
+    '''
+    Description: 在临时目录中运行一次MasterSpider，应在独立的进程中调用，从而各组合的指标和峰值内存互不影响
+    Args:
+        case: 测试参数字典
+    Returns:
+        测试结果字典
+    '''
+    import config
+    import metrics
+    import spider
+
+    config.crawl_state_backend = case["backend"]
+    config.work_queue_maxsize = case["queue_maxsize"]
+    config.frontier_rate_per_host = case["rate_per_host"]
+    config.metrics_port = None
+    config.metrics_snapshot_file = None
+    #默认的延迟直方图桶较粗，测试时替换为更细的桶
+    metrics.DOWNLOAD_SECONDS = metrics.Histogram("imagespider_download_seconds", "下载延迟", LATENCY_BUCKETS)
+
+    work_dir = tempfile.mkdtemp(prefix = "imagespider-bench-")
+    cur_dir = os.path.abspath(".")
+    os.chdir(work_dir)
+    try:
+        urls = ["%s/img/%d.png" % (case["base_url"], i) for i in range(case["images"])]
+        web_class_list = [(make_fake_web("bench-site-%d" % (i), urls[i::case["sites"]]), "english")
+                            for i in range(case["sites"])]
+        master_spider = spider.MasterSpider(web_class_list, "images", dev_mode = False,
+                                            worker_num = case["workers"], download_engine = case["engine"])
+        start = time.monotonic()
+        master_spider.start()
+        elapsed = time.monotonic() - start
+    finally:
+        os.chdir(cur_dir)
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+    latency = metrics.DOWNLOAD_SECONDS.snapshot()
+    downloads = metrics.DOWNLOADS.total()
+    return {
+        "elapsed": elapsed,
+        "downloads": downloads,
+        "failures": metrics.DOWNLOAD_FAILURES.snapshot(),
+        "images_per_sec": downloads / elapsed,
+        "mb_per_sec": metrics.DOWNLOAD_BYTES.total() / elapsed / (1024 * 1024),
+        "latency_p50_ms": None if latency["p50"] is None else latency["p50"] * 1000,
+        "latency_p99_ms": None if latency["p99"] is None else latency["p99"] * 1000,
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+def run_case_in_subprocess(case):
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+                            stdout = subprocess.PIPE, universal_newlines = True)
+    if proc.returncode != 0:
+        logging.error("测试组合运行失败: %s" % (case))
+        return None
+    #子进程输出的最后一行为测试结果
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def get_version():
+    '''
+    Description: 获取当前代码的git版本，用于比较不同版本的测试结果
+    '''
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                                        cwd = os.path.dirname(os.path.abspath(__file__)),
+                                        stderr = subprocess.DEVNULL, universal_newlines = True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _int_list(value):
+    return [int(v) for v in value.split(",")]
+
+def main():
+    parser = argparse.ArgumentParser(description = "图片下载性能测试")
+    benchserver.add_server_arguments(parser)
+    parser.add_argument("--images", type = int, default = 1000, help = "每个组合下载的图片数量")
+    parser.add_argument("--sites", type = int, default = 2, help = "模拟网站数量")
+    parser.add_argument("--workers", type = _int_list, default = [1, 4, 16], help = "worker_num列表，逗号分隔")
+    parser.add_argument("--queue-maxsize", type = _int_list, default = [10000], help = "任务队列最大长度列表，逗号分隔")
+    parser.add_argument("--engines", default = "thread", help = "下载引擎列表，逗号分隔，可选thread、asyncio")
+    parser.add_argument("--backend", default = "sqlite", help = "爬取状态存储方式")
+    parser.add_argument("--rate-per-host", type = float, default = None, help = "每个主机每秒最多分发的URL数量，默认不限速")
+    parser.add_argument("--output", default = "benchmark.json", help = "结果文件")
+    parser.add_argument("--case", help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.WARNING)
+    if args.case:
+        #子进程模式，运行一个组合并输出结果
+        logging.getLogger().setLevel(logging.CRITICAL)
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    server = benchserver.BenchImageServer(args.host, 0, args.image_size, args.latency,
+                                            args.error_rate, args.keep_alive).start()
+    results = []
+    try:
+        for engine, workers, queue_maxsize in itertools.product(args.engines.split(","), args.workers,
+                                                                args.queue_maxsize):
+            case = {"base_url": server.base_url, "images": args.images, "sites": args.sites, "engine": engine,
+                    "workers": workers, "queue_maxsize": queue_maxsize, "backend": args.backend,
+                    "rate_per_host": args.rate_per_host}
+            result = run_case_in_subprocess(case)
+            if result is None:
+                continue
+            case.pop("base_url")
+            case.update(result)
+            results.append(case)
+            print("engine=%s workers=%d queue_maxsize=%d: %.1f images/s, %.2f MB/s, p50=%.1fms, p99=%.1fms, "
+                    "peak_rss=%.1fMB" % (engine, workers, queue_maxsize, result["images_per_sec"], result["mb_per_sec"],
+                    result["latency_p50_ms"] or 0, result["latency_p99_ms"] or 0, result["peak_rss_mb"] or 0))
+    finally:
+        server.stop()
+
+    report = {
+        "version": get_version(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "server": {"image_size": args.image_size, "latency": args.latency, "error_rate": args.error_rate,
+                    "keep_alive": args.keep_alive},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent = 1)
+    print("测试结果已保存到 %s" % (args.output))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+'''
+本文件实现了用于性能测试的本地图片服务器，返回指定大小的合成PNG图片，可设置响应延迟、
+出错比例以及是否保持长连接，每个URL返回的图片内容不同，不会被下载时的内容去重合并，
+可单独运行：python benchserver.py --port 8000 --image-size 65536 --latency 0.05
+'''
+import argparse
+import http.server
+import random
+import struct
+import threading
+import time
+import zlib
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+#合成图片每行的像素数
+_PNG_WIDTH = 1024
+
+class _ImageHTTPServer(http.server.ThreadingHTTPServer):
+    #大量下载线程同时建立连接时避免连接被拒绝
+    request_queue_size = 1024
+    daemon_threads = True
+
+def _png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+class SyntheticImages():
+    '''
+    合成图片生成器，同一大小的像素数据只生成一次，每张图片通过tEXt块写入不同的标识
+    '''
+    def __init__(self, seed = 0):
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+        self.cache = {}                 #图片大小 -> (IHDR块, IDAT块)
+
+    def _get_body(self, size):
+        with self.lock:
+            body = self.cache.get(size)
+            if body is None:
+                row_size = _PNG_WIDTH * 3
+                rows = max(1, size // (row_size + 1))
+                #像素为随机数据，不压缩，从而图片大小与size接近
+                raw = b"".join(b"\x00" + self.rand.randbytes(row_size) for _ in range(rows))
+                ihdr = _png_chunk(b"IHDR", struct.pack(">IIBBBBB", _PNG_WIDTH, rows, 8, 2, 0, 0, 0))
+                idat = _png_chunk(b"IDAT", zlib.compress(raw, 0))
+                body = (ihdr, idat)
+                self.cache[size] = body
+            return body
+
+    def build(self, size, tag):
+        '''
+        Description: 生成一张大小约为size字节的PNG图片
+        Args:
+            tag: 写入图片的标识，不同标识的图片内容不同
+        '''
+        ihdr, idat = self._get_body(size)
+        text = _png_chunk(b"tEXt", b"Comment\x00" + tag.encode("utf-8"))
+        return _PNG_SIGNATURE + ihdr + text + idat + _png_chunk(b"IEND", b"")
+
+class BenchImageServer():
+    '''
+    本地图片服务器，在后台线程中运行，任意路径都返回一张合成图片
+    '''
+    def __init__(self, host = "127.0.0.1", port = 0, image_size = 64 * 1024, latency = 0.0,
+                error_rate = 0.0, keep_alive = True, seed = 0):
+        '''
+        Description: 初始化函数
+        Args:
+            port: 监听端口，为0时由系统分配
+            image_size: 图片大小（字节）
+            latency: 每个请求返回前等待的时间（秒）
+            error_rate: 返回503错误的请求比例
+            keep_alive: 是否保持长连接，为False时每个响应后关闭连接
+            seed: 随机数种子
+        '''
+        self.host = host
+        self.port = port
+        self.image_size = image_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.keep_alive = keep_alive
+        self.images = SyntheticImages(seed)
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.server = None
+
+    def _make_handler(self):
+        bench = self
+
+        class ImageHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" if bench.keep_alive else "HTTP/1.0"
+            #响应头和图片数据分两次写入，关闭Nagle算法以免与客户端的延迟确认叠加产生额外延迟
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with bench.lock:
+                    bench.requests += 1
+                    failed = bench.rand.random() < bench.error_rate
+                    if failed:
+                        bench.errors += 1
+                if bench.latency > 0:
+                    time.sleep(bench.latency)
+                if failed:
+                    body = b""
+                    self.send_response(503)
+                else:
+                    body = bench.images.build(bench.image_size, self.path)
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                if not bench.keep_alive:
+                    self.send_header("Connection", "close")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return ImageHandler
+
+    def start(self):
+        self.server = _ImageHTTPServer((self.host, self.port), self._make_handler())
+        self.port = self.server.server_address[1]
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        return self
+
+    @property
+    def base_url(self):
+        return "http://%s:%d" % (self.host, self.port)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def add_server_arguments(parser):
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--image-size", type = int, default = 64 * 1024, help = "图片大小（字节）")
+    parser.add_argument("--latency", type = float, default = 0.0, help = "每个请求的响应延迟（秒）")
+    parser.add_argument("--error-rate", type = float, default = 0.0, help = "返回503错误的请求比例")
+    parser.add_argument("--no-keep-alive", dest = "keep_alive", action = "store_false", help = "每个响应后关闭连接")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "性能测试用的本地图片服务器")
+    add_server_arguments(parser)
+    parser.add_argument("--port", type = int, default = 8000)
+    args = parser.parse_args()
+    server = BenchImageServer(args.host, args.port, args.image_size, args.latency,
+                                args.error_rate, args.keep_alive).start()
+    print("图片服务器地址: %s" % (server.base_url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
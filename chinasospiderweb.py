@@ -3,6 +3,7 @@
 该网站同时支持懒加载模式和分页模式
 '''
 import logging
+import urllib.parse
 from selenium import webdriver
 import selenium.common.exceptions as exception
 from basespiderweb import BaseSpiderWeb
@@ -10,6 +11,11 @@ import time
 
 #此处实现split_page模式
 class ChinasoSpiderWeb(BaseSpiderWeb):
+    #大图页面中“原始图片”链接
+    original_url_rules = [("#yuanshi", "href")]
+    #HTTP抓取模式使用图片搜索的JSON接口，rn为每页数量，st为起始位置
+    http_url = "http://image.chinaso.com/getpic?rn=50&st=0&q={keywords}"
+
     def __init__(self, put_url_2_queue_func, get_img_func = None, dev_mode = True,
                     image_folder = ".", keywrods = ""):
         BaseSpiderWeb.__init__(self, "Chinaso", "http://image.chinaso.com/",
@@ -67,19 +73,22 @@ class ChinasoSpiderWeb(BaseSpiderWeb):
             return False
         return True
     
-    def get_original_urls_this_page(self):
+    def parse_page(self, response):
         '''
-        Description: 直接从搜索的主页面获取原图URL
-        Returns: 
-            url: 从新页面上获取到的一张原图片的URL
-            None: 未获取到图片URL
+        Description: 解析JSON接口返回的一页搜索结果，下一页的URL由当前URL的st加上rn得到
         '''
-        try:
-            src_a = self.driver.find_element_by_id("yuanshi")
-            return [src_a.get_attribute("href")]
-        except exception.NoSuchElementException as e:
-            logging.error("%s error: %s" %(self.name, e))
-            return None
+        data = response.json()
+        results = data.get("arrResults") or []
+        urls = [item["url"] for item in results if item.get("url")]
+        parts = urllib.parse.urlsplit(response.url)
+        query = dict(urllib.parse.parse_qsl(parts.query))
+        rn = int(query.get("rn", len(results)))
+        st = int(query.get("st", 0)) + rn
+        next_page_url = None
+        if results and rn > 0 and st < int(data.get("total", 0)):
+            query["st"] = str(st)
+            next_page_url = urllib.parse.urlunsplit(parts._replace(query = urllib.parse.urlencode(query)))
+        return urls or None, next_page_url
 
     def switch_to_split_mode(self):
         '''
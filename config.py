@@ -3,3 +3,140 @@
 '''
 keywords_chinese = "钓鱼"
 keywords_english = "fishing"
+
+#去重方式，可选感知哈希"dhash"、"phash"或者RGB直方图"rgb_hist"
+dedup_method = "dhash"
+#相似度大于该值的图片视为重复图片（与原RGB直方图去重阈值一致）
+dedup_similarity = 0.95
+#去重时提取图片特征的进程数量，为None时使用CPU核数
+dedup_worker_num = None
+#每次分配给特征提取进程的图片数量
+dedup_chunk_size = 64
+
+#图片下载超时时间（秒）
+download_timeout = 10
+#允许下载的最大图片大小（字节），超过后立即放弃
+download_max_size = 50 * 1024 * 1024
+#流式下载时每次读取的数据块大小（字节）
+download_chunk_size = 64 * 1024
+#下载中断后在本次下载中使用Range请求续传的最大次数，未完成的部分保存在.part文件中，重启后也可继续续传
+download_resume_attempts = 3
+#asyncio下载引擎同时进行的最大下载数量
+async_max_concurrency = 1000
+#asyncio下载引擎对同一主机同时进行的最大下载数量
+async_per_host_concurrency = 16
+#下载线程缓存连接池的主机数量
+http_pool_connections = 100
+#每个主机连接池中保持的最大连接数
+http_pool_maxsize = 10
+
+#任务队列中每个主机每秒最多分发的URL数量，为None时不限速，默认不限速，需要对单个主机限速时再设置
+frontier_rate_per_host = None
+#每个主机允许的突发请求数量，frontier_rate_per_host为None时不起作用
+frontier_burst = 20
+#主机权重，格式为{"主机": 权重}，轮询到该主机时连续分发权重个URL，未配置的主机权重为1
+frontier_host_weights = {}
+#任务队列中最多保存的URL数量，队列满时获取URL的线程等待下载线程，小于等于0时不限制
+work_queue_maxsize = 10000
+
+#爬取状态存储方式，"sqlite"为SQLite数据库，"text"为原有的all_img_urls.txt等文本文件
+crawl_state_backend = "sqlite"
+#从断点恢复时每次放入任务队列的url数量
+resume_chunk_size = 1000
+#SQLite爬取状态数据库文件
+crawl_state_db = "crawl_state.db"
+#SQLite爬取状态累积多少条写操作后提交一次事务
+crawl_state_commit_batch = 1000
+#SQLite爬取状态距上次提交超过多少秒后提交事务
+crawl_state_commit_interval = 1.0
+#文本爬取状态在内存中保存URL集合的方式，"set"保存完整URL，"bloom"使用布隆过滤器，内存占用有限但存在误判
+url_set_mode = "set"
+#布隆过滤器的误判率，误判时新URL会被当作已发现或已下载的URL而跳过
+url_filter_error_rate = 0.0001
+#布隆过滤器的初始容量，URL数量超过容量后自动扩容
+url_filter_initial_capacity = 1000000
+#文本爬取状态的日志文件每次批量写入的最大记录数
+journal_batch_size = 1000
+#文本爬取状态的日志记录在缓冲区中的最长等待时间（毫秒）
+journal_flush_interval_ms = 200
+#文本爬取状态的日志文件写入后是否调用fsync
+journal_fsync = False
+
+#下载失败重试设置，失败类型见retryqueue.py
+#每种失败类型的最大尝试次数（包括第一次下载），达到次数后记录为永久失败，不再请求，未列出的类型只尝试一次
+retry_max_attempts = {"timeout": 4, "connection": 4, "throttled": 6, "http_5xx": 4,
+                        "http_4xx": 1, "not_image": 1, "too_large": 1, "other": 2}
+#第n次失败后等待retry_backoff_base * 2^(n-1)秒再重试，最多等待retry_backoff_max秒，实际等待时间有±50%的随机抖动
+retry_backoff_base = 5
+retry_backoff_max = 600
+#所有URL分发完成后，下载线程退出前等待多少秒内到期的重试，更晚到期的重试保存在爬取状态中，下次运行时继续
+retry_drain_wait = 60
+
+#监控指标设置，见metrics.py
+#以Prometheus文本格式输出指标的本地HTTP端口，例如9108，为None时不启动HTTP服务
+metrics_port = None
+#HTTP服务监听的地址
+metrics_host = "127.0.0.1"
+#定期写入的JSON快照文件，例如"metrics.json"，为None时不写入
+metrics_snapshot_file = None
+#写入JSON快照的时间间隔（秒）
+metrics_snapshot_interval = 10
+
+#内存分析设置，见memprofile.py，关闭时不启动tracemalloc，没有额外开销
+memprofile_enabled = False
+#保存内存分析结果的文件夹
+memprofile_dir = "memprofile"
+#定期获取内存快照的时间间隔（秒）
+memprofile_interval = 60
+#每个阶段写入文件的分配位置数量
+memprofile_top_n = 20
+#tracemalloc记录的调用栈深度，深度越大越容易按模块划分阶段，但开销也越大
+memprofile_nframe = 30
+#分配位置的统计方式，"lineno"、"filename"或"traceback"
+memprofile_key_type = "lineno"
+
+#WebDriver池中最多同时存在的浏览器数量，所有网站共用，没有可用浏览器时网站等待其他网站归还
+driver_pool_max_browsers = 4
+
+#懒加载等待设置，滚动页面后监视的元素数量变化或网络请求静止时立即继续，不再固定等待
+#滚动后最长等待时间（秒）
+lazy_load_timeout = 10
+#没有新完成的资源请求多长时间（秒）后认为网络已静止
+lazy_load_settle_time = 1.0
+#检查页面加载状态的时间间隔（秒）
+lazy_load_poll_interval = 0.2
+
+#并行打开详细页面的工作浏览器数量，用于不能从主页面直接获取原图URL的网站，为1时在当前浏览器中依次打开
+detail_page_workers = 4
+#获取第一个工作浏览器的最长等待时间（秒），其余工作浏览器只使用WebDriver池中立即可用的
+detail_page_acquire_timeout = 30
+
+#HTTP抓取模式设置，使用该模式的网站不启动浏览器，直接请求结果页面并解析，见BaseSpiderWeb.fetch_mode
+#使用HTTP抓取模式的网站名称列表，例如["DogPile", "Chinaso"]
+http_fetch_sites = []
+#覆盖网站的搜索结果页URL模板，键为网站名称，{keywords}替换为关键词，可指向本地保存的页面用于测试
+http_fetch_urls = {}
+#请求结果页面的超时时间（秒）
+http_fetch_timeout = 30
+
+#浏览器资源屏蔽设置，只读取页面中URL时不需要加载的资源可以屏蔽，从而加快页面加载并减少浏览器的流量和内存
+#屏蔽配置为字典，可包含以下字段：
+#   images: 是否禁止加载图片，图片的src等属性仍然可以读取，在浏览器中下载图片的网站不能开启
+#   block_urls: 屏蔽的URL模式，只有*为通配符，例如广告和统计脚本
+#   block_resource_types: 按扩展名屏蔽的资源类型，可选"font"、"stylesheet"、"media"、"image"，
+#           Chrome不能按请求类型或是否为第三方屏蔽，所有主机的这些扩展名都会被屏蔽
+#   allow_urls: 懒加载需要的脚本等不能被屏蔽的URL，会屏蔽其中任一URL的模式被忽略
+#未在block_profiles中列出的网站使用的屏蔽配置，为None时不屏蔽
+block_profile_default = {
+    "images": False,
+    "block_urls": ["*googletagmanager.com/*", "*google-analytics.com/*", "*doubleclick.net/*",
+                    "*googlesyndication.com/*", "*hm.baidu.com/*", "*cnzz.com/*"],
+    "block_resource_types": ["font", "media"],
+    "allow_urls": [],
+}
+#各网站的屏蔽配置，键为网站名称
+block_profiles = {
+    "DogPile": dict(block_profile_default, images = True),
+    "Chinaso": dict(block_profile_default, images = True),
+    "1688": dict(block_profile_default, images = True),
+}
@@ -0,0 +1,557 @@
+'''
+本文件实现了爬取状态的存储，用于从断点处继续抓取，包括所有已发现的图片URL、下载状态、
+下载失败记录和重试计划以及各网站已爬取的页面断点，提供两种实现：
+    SqliteCrawlState: 所有状态保存在一个WAL模式的SQLite数据库中，使用索引查询，批量提交事务，
+            启动时不需要把所有URL读入内存
+    TextCrawlState: 原有的文本文件实现，URL保存在all_img_urls.txt和downloaded_img_urls.txt中，
+            启动时全部读入内存，超大规模抓取时可使用布隆过滤器代替内存中的URL集合
+'''
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import config
+import urlfilter
+
+#旧版本使用的文本文件
+ALL_URLS_FILE = "all_img_urls.txt"
+DOWNLOADED_URLS_FILE = "downloaded_img_urls.txt"
+FAILED_URLS_FILE = "failed_img_urls.txt"
+
+#URL下载状态
+STATUS_PENDING = 0
+STATUS_DOWNLOADED = 1
+STATUS_FAILED = 2           #永久失败，不再请求
+STATUS_RETRY = 3            #等待重试
+
+def get_history_page_file(site):
+    return "%s-history-page.txt" % (site)
+
+def read_history_page_file(site):
+    '''
+    Description: 读取网站的页面断点文件，文件中最后一行为最近一次爬取的页面URL，
+            以#开头表示网站已爬取到最后一页
+    Returns:
+        (页面URL, 是否已爬取完成)，没有断点时页面URL为None
+    '''
+    file_name = get_history_page_file(site)
+    if os.path.isfile(file_name):
+        with open(file_name) as f:
+            lines = [line.strip() for line in f.readlines() if line.strip()]
+        if len(lines) > 0:
+            if lines[-1][0] == "#":
+                return lines[-1][1:], True
+            return lines[-1], False
+    return None, False
+
+def write_history_page_file(site, page_url, finished = False):
+    with open(get_history_page_file(site), "w") as f:
+        f.write(("#" if finished else "") + page_url + "\n")
+
+def open_crawl_state(backend = None):
+    '''
+    Description: 根据配置创建爬取状态存储对象
+    Args:
+        backend: "sqlite"或"text"，默认使用config.crawl_state_backend
+    '''
+    backend = backend or config.crawl_state_backend
+    if backend == "sqlite":
+        return SqliteCrawlState(config.crawl_state_db)
+    elif backend == "text":
+        return TextCrawlState()
+    raise ValueError("Error parameter: backend")
+
+class JournalWriter(threading.Thread):
+    '''
+    日志文件的后台批量写入线程，调用者只把记录放入缓冲区，不再在锁中打开、写入和关闭文件，
+    缓冲区达到batch_size条或最早的记录等待超过interval_ms毫秒时统一写入文件
+    '''
+    def __init__(self, file_name, batch_size = None, interval_ms = None, fsync = None, depends_on = None):
+        '''
+        Description: 初始化函数
+        Args:
+            file_name: 日志文件
+            depends_on: 另一个JournalWriter，本日志每次写入前先等待其写入完成，从而保证两个文件之间的先后顺序
+            batch_size: 每次批量写入的最大记录数，默认使用config.journal_batch_size
+            interval_ms: 记录在缓冲区中的最长等待时间（毫秒），默认使用config.journal_flush_interval_ms
+            fsync: 写入后是否调用fsync，默认使用config.journal_fsync
+        '''
+        threading.Thread.__init__(self, daemon = True)
+        self.file_name = file_name
+        self.batch_size = batch_size or config.journal_batch_size
+        self.interval = (interval_ms if interval_ms is not None else config.journal_flush_interval_ms) / 1000.0
+        self.fsync = config.journal_fsync if fsync is None else fsync
+        self.depends_on = depends_on
+        self.cond = threading.Condition()
+        self.buffer = []
+        self.appended = 0               #已放入缓冲区的记录数
+        self.written = 0                #已写入文件的记录数
+        self.flush_requested = False
+        self.closed = False
+        self.start()
+
+    def append(self, line):
+        with self.cond:
+            self.buffer.append(line)
+            self.appended += 1
+            #缓冲区由空变为非空时开始计时，缓冲区满时立即写入
+            if len(self.buffer) == 1 or len(self.buffer) >= self.batch_size:
+                self.cond.notify_all()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.buffer and not self.closed:
+                    self.cond.wait()
+                deadline = time.monotonic() + self.interval
+                while len(self.buffer) < self.batch_size and not self.flush_requested and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                lines, self.buffer = self.buffer, []
+                target = self.appended
+                self.flush_requested = False
+                closing = self.closed
+            if lines:
+                if self.depends_on is not None:
+                    self.depends_on.flush()
+                #每批记录打开一次文件，文件被删除后会重新创建
+                with open(self.file_name, "a") as f:
+                    f.write("".join(lines))
+                    if self.fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+            with self.cond:
+                self.written = target
+                self.cond.notify_all()
+                if closing and not self.buffer:
+                    return
+
+    def flush(self):
+        '''
+        Description: 等待调用前放入缓冲区的记录全部写入文件
+        '''
+        with self.cond:
+            target = self.appended
+            if self.written >= target:
+                return
+            self.flush_requested = True
+            self.cond.notify_all()
+            while self.written < target and self.is_alive():
+                self.cond.wait(0.1)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.join()
+
+class TextCrawlState():
+    '''
+    基于文本文件的爬取状态存储，所有URL保存在内存集合中，文件由JournalWriter在后台批量追加，
+    保存页面断点前会先等待URL记录写入文件，从而保证断点之前发现的URL都已保存
+    '''
+    def __init__(self):
+        self.all_urls_file = ALL_URLS_FILE
+        self.downloaded_urls_file = DOWNLOADED_URLS_FILE                #抓取成功url历史记录文件
+        self.failed_urls_file = FAILED_URLS_FILE                        #下载失败记录文件，每行为一次失败
+        #不允许all_urls_file不存在但是downloaded_urls_file存在的情况
+        assert os.path.exists(self.all_urls_file) or not os.path.exists(self.downloaded_urls_file),\
+                 "all_img_urls.txt not found but downloaded_img_urls.txt found"
+
+        #url_set_mode为"bloom"时使用布隆过滤器代替set，过滤器保存在日志文件旁边
+        self.use_bloom = config.url_set_mode == "bloom"
+        self.all_file_lock = threading.Lock()                           #所有url文件锁
+        self.all_urls_set = self._load_url_set(self.all_urls_file)
+
+        self.downloaded_file_lock = threading.Lock()                    #抓取成功url历史文件写入锁
+        self.downloaded_urls_set = self._load_url_set(self.downloaded_urls_file)
+
+        self.failed_lock = threading.Lock()
+        self.failures = self._load_failures()                           #url -> (失败类型, 失败次数, 下次重试时间, 是否永久失败)
+
+        self.all_urls_journal = JournalWriter(self.all_urls_file)
+        #已下载的url必须先出现在all_urls_file中
+        self.downloaded_urls_journal = JournalWriter(self.downloaded_urls_file,
+                                                    depends_on = self.all_urls_journal)
+        self.failed_urls_journal = JournalWriter(self.failed_urls_file)
+
+    def _load_url_set(self, journal_file):
+        if self.use_bloom:
+            return urlfilter.load_url_filter(journal_file, journal_file + ".bloom",
+                                            config.url_filter_initial_capacity, config.url_filter_error_rate)
+        urls_set = set()
+        if os.path.exists(journal_file):
+            with open(journal_file) as f:
+                for line in f:
+                    urls_set.add(line.strip())
+        return urls_set
+
+    def _load_failures(self):
+        '''
+        Description: 读取失败记录文件，同一url只保留最后一条记录，已下载成功的url不再保留
+        '''
+        failures = {}
+        if os.path.exists(self.failed_urls_file):
+            with open(self.failed_urls_file) as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    #url、失败类型、失败次数、下次重试时间、是否永久失败、失败时间
+                    if len(fields) < 6:
+                        continue
+                    url, kind, attempts, next_retry_at, permanent = fields[:5]
+                    failures[url] = (kind, int(attempts), float(next_retry_at) if next_retry_at else None,
+                                    permanent == "1")
+        for url in [url for url in failures if url in self.downloaded_urls_set]:
+            del failures[url]
+        return failures
+
+    def _new_url_set(self):
+        if self.use_bloom:
+            return urlfilter.ScalableBloomFilter(config.url_filter_initial_capacity, config.url_filter_error_rate)
+        return set()
+
+    def add_url(self, url):
+        '''
+        Description: 记录新发现的URL
+        Returns:
+            True: 新的URL，False: URL之前已经记录过
+        '''
+        with self.all_file_lock:
+            #重复任务不再入队列
+            if url in self.all_urls_set:
+                return False
+            self.all_urls_set.add(url)
+        self.all_urls_journal.append(url+"\n")
+        return True
+
+    def mark_downloaded(self, url):
+        with self.downloaded_file_lock:
+            self.downloaded_urls_set.add(url)
+        with self.failed_lock:
+            self.failures.pop(url, None)
+        self.downloaded_urls_journal.append(url+"\n")
+
+    def is_downloaded(self, url):
+        with self.downloaded_file_lock:
+            return url in self.downloaded_urls_set
+
+    def record_failure(self, url, kind, attempts, next_retry_at, permanent):
+        '''
+        Description: 记录一次下载失败
+        Args:
+            kind: 失败类型
+            attempts: 该url已失败的次数
+            next_retry_at: 下次重试的时间戳，永久失败时为None
+            permanent: 是否永久失败
+        '''
+        with self.failed_lock:
+            self.failures[url] = (kind, attempts, next_retry_at, permanent)
+        self.failed_urls_journal.append("%s\t%s\t%d\t%s\t%d\t%f\n" % (url, kind, attempts,
+                                        "" if next_retry_at is None else "%f" % (next_retry_at),
+                                        int(permanent), time.time()))
+
+    def iter_retries(self):
+        '''
+        Description: 迭代所有等待重试的URL
+        Returns:
+            (url, 失败类型, 失败次数, 下次重试时间)
+        '''
+        with self.failed_lock:
+            retries = [(url, kind, attempts, next_retry_at)
+                        for url, (kind, attempts, next_retry_at, permanent) in self.failures.items() if not permanent]
+        return iter(retries)
+
+    def iter_pending(self):
+        '''
+        Description: 迭代所有已发现但未下载成功、也没有下载失败记录的URL，结果为调用时的快照
+        '''
+        if self.use_bloom:
+            #布隆过滤器无法枚举元素，从日志文件中读取
+            return self._iter_pending_from_journal()
+        with self.all_file_lock, self.downloaded_file_lock, self.failed_lock:
+            pending = self.all_urls_set - self.downloaded_urls_set - self.failures.keys()
+        return iter(pending)
+
+    def _iter_pending_from_journal(self):
+        self.flush()
+        if not os.path.exists(self.all_urls_file):
+            return iter(())
+        #只读取调用时已有的记录，之后新发现的URL由调用者直接放入队列，
+        #文件长度在调用时确定，而不是在第一次迭代时
+        return self._iter_journal_until(os.path.getsize(self.all_urls_file))
+
+    def _iter_journal_until(self, end):
+        with open(self.all_urls_file, "rb") as f:
+            while f.tell() < end:
+                url = f.readline().decode("utf-8").strip()
+                if url and not self.is_downloaded(url) and url not in self.failures:
+                    yield url
+
+    def is_complete(self):
+        '''
+        Description: 所有url都已下载成功或永久失败时，说明所有内容都抓取完成
+        '''
+        if len(self.all_urls_set) == 0 or next(self.iter_retries(), None) is not None:
+            return False
+        return next(self.iter_pending(), None) is None
+
+    def reset(self):
+        '''
+        Description: 所有内容抓取完成后删除URL记录
+        '''
+        self.flush()
+        for file_name in [self.all_urls_file, self.downloaded_urls_file, self.failed_urls_file,
+                            self.all_urls_file + ".bloom", self.downloaded_urls_file + ".bloom"]:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+        self.all_urls_set = self._new_url_set()
+        self.downloaded_urls_set = self._new_url_set()
+        self.failures = {}
+
+    def get_checkpoint(self, site):
+        return read_history_page_file(site)
+
+    def save_checkpoint(self, site, page_url, finished = False):
+        self.all_urls_journal.flush()
+        write_history_page_file(site, page_url, finished)
+
+    def flush(self):
+        for journal in [self.all_urls_journal, self.downloaded_urls_journal, self.failed_urls_journal]:
+            journal.flush()
+
+    def close(self):
+        for journal in [self.all_urls_journal, self.downloaded_urls_journal, self.failed_urls_journal]:
+            journal.close()
+        if self.use_bloom:
+            #记录过滤器已覆盖的日志文件长度，下次启动时只需重放之后的记录
+            for urls_set, journal_file in [(self.all_urls_set, self.all_urls_file),
+                                            (self.downloaded_urls_set, self.downloaded_urls_file)]:
+                urls_set.journal_offset = os.path.getsize(journal_file) if os.path.exists(journal_file) else 0
+                urls_set.save(journal_file + ".bloom")
+
+class SqliteCrawlState():
+    '''
+    基于SQLite的爬取状态存储，所有线程共用一个连接，写操作在同一个事务中累积，
+    达到config.crawl_state_commit_batch条或距上次提交超过config.crawl_state_commit_interval秒时提交，
+    之后没有新的写操作时由定时器提交，保存页面断点时立即提交，从而保证断点之前发现的URL都已写入数据库
+    '''
+    def __init__(self, db_file):
+        self.db_file = db_file
+        is_new = not os.path.exists(self.db_file)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_file, check_same_thread = False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS urls_status ON urls (status);
+            CREATE TABLE IF NOT EXISTS failures (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                failed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS failures_url ON failures (url);
+            CREATE TABLE IF NOT EXISTS retries (
+                url TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                next_retry_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                site TEXT PRIMARY KEY,
+                page_url TEXT NOT NULL,
+                finished INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            );
+        ''')
+        self.conn.commit()
+        self.pending_writes = 0
+        self.last_commit = time.monotonic()
+        self.commit_timer = None
+        self.closed = False
+        if is_new:
+            self._import_text_files()
+
+    def _import_text_files(self):
+        '''
+        Description: 首次创建数据库时导入旧版本的文本文件
+        '''
+        now = time.time()
+        for file_name, status in [(ALL_URLS_FILE, STATUS_PENDING), (DOWNLOADED_URLS_FILE, STATUS_DOWNLOADED)]:
+            if not os.path.exists(file_name):
+                continue
+            logging.info("导入旧的URL记录文件: %s" % (file_name))
+            with open(file_name) as f:
+                rows = ((line.strip(), status, now) for line in f if line.strip())
+                self.conn.executemany("INSERT INTO urls (url, status, updated_at) VALUES (?, ?, ?) "
+                                        "ON CONFLICT(url) DO UPDATE SET status = MAX(status, excluded.status)", rows)
+        self.conn.commit()
+
+    def _wrote(self, count = 1):
+        '''
+        Description: 写操作完成后调用，必要时提交事务，调用者需持有self.lock
+        '''
+        self.pending_writes += count
+        elapsed = time.monotonic() - self.last_commit
+        if self.pending_writes >= config.crawl_state_commit_batch or \
+            elapsed >= config.crawl_state_commit_interval:
+            self._commit()
+        elif self.commit_timer is None:
+            #写操作停止后（例如下载停滞时）也在commit_interval内提交
+            self.commit_timer = threading.Timer(config.crawl_state_commit_interval - elapsed, self._timed_commit)
+            self.commit_timer.daemon = True
+            self.commit_timer.start()
+
+    def _timed_commit(self):
+        with self.lock:
+            if not self.closed and self.pending_writes > 0:
+                self._commit()
+
+    def _commit(self):
+        self.conn.commit()
+        self.pending_writes = 0
+        self.last_commit = time.monotonic()
+        if self.commit_timer is not None:
+            self.commit_timer.cancel()
+            self.commit_timer = None
+
+    def add_url(self, url):
+        '''
+        Description: 记录新发现的URL
+        Returns:
+            True: 新的URL，False: URL之前已经记录过
+        '''
+        with self.lock:
+            cur = self.conn.execute("INSERT OR IGNORE INTO urls (url, status, updated_at) VALUES (?, ?, ?)",
+                                    (url, STATUS_PENDING, time.time()))
+            if cur.rowcount == 0:
+                return False
+            self._wrote()
+        return True
+
+    def mark_downloaded(self, url):
+        with self.lock:
+            self.conn.execute("INSERT INTO urls (url, status, updated_at) VALUES (?, ?, ?) "
+                                "ON CONFLICT(url) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at",
+                                (url, STATUS_DOWNLOADED, time.time()))
+            self.conn.execute("DELETE FROM retries WHERE url = ?", (url,))
+            self._wrote()
+
+    def is_downloaded(self, url):
+        with self.lock:
+            row = self.conn.execute("SELECT status FROM urls WHERE url = ?", (url,)).fetchone()
+        return row is not None and row[0] == STATUS_DOWNLOADED
+
+    def record_failure(self, url, kind, attempts, next_retry_at, permanent):
+        '''
+        Description: 记录一次下载失败，failures表保存每次失败，retries表保存每个url最新的重试计划
+        Args:
+            kind: 失败类型
+            attempts: 该url已失败的次数
+            next_retry_at: 下次重试的时间戳，永久失败时为None
+            permanent: 是否永久失败
+        '''
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT INTO failures (url, reason, failed_at) VALUES (?, ?, ?)", (url, kind, now))
+            self.conn.execute("INSERT INTO urls (url, status, updated_at) VALUES (?, ?, ?) "
+                                "ON CONFLICT(url) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at",
+                                (url, STATUS_FAILED if permanent else STATUS_RETRY, now))
+            self.conn.execute("INSERT OR REPLACE INTO retries (url, kind, attempts, next_retry_at) VALUES (?, ?, ?, ?)",
+                                (url, kind, attempts, next_retry_at))
+            self._wrote()
+
+    def iter_retries(self):
+        '''
+        Description: 迭代所有等待重试的URL
+        Returns:
+            (url, 失败类型, 失败次数, 下次重试时间)
+        '''
+        with self.lock:
+            rows = self.conn.execute("SELECT r.url, r.kind, r.attempts, r.next_retry_at FROM retries r "
+                                        "JOIN urls u ON u.url = r.url WHERE u.status = ?", (STATUS_RETRY,)).fetchall()
+        return iter(rows)
+
+    def iter_pending(self, batch_size = 10000):
+        '''
+        Description: 迭代所有已发现但未下载成功、也没有下载失败记录的URL，使用独立的只读连接按rowid分批读取，
+                每批是一个单独的短查询，不会在整个迭代期间保持读事务，否则受任务队列限速的迭代可能持续数小时，
+                期间WAL检查点无法完成，WAL文件会不断增长，只返回开始迭代时已存在的URL，
+                之后新发现的URL已由爬取线程放入任务队列
+        '''
+        self.flush()
+        #最大rowid在调用时确定，而不是在第一次迭代时，否则调用后、开始迭代前新发现的URL会被重复返回
+        with self.lock:
+            max_rowid = self.conn.execute("SELECT MAX(rowid) FROM urls").fetchone()[0]
+        if max_rowid is None:
+            return iter(())
+        return self._iter_pending_rows(max_rowid, batch_size)
+
+    def _iter_pending_rows(self, max_rowid, batch_size):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            last_rowid = 0
+            while True:
+                rows = conn.execute("SELECT rowid, url FROM urls WHERE status = ? AND rowid > ? AND rowid <= ? "
+                                    "ORDER BY rowid LIMIT ?", (STATUS_PENDING, last_rowid, max_rowid,
+                                    batch_size)).fetchall()
+                if not rows:
+                    break
+                last_rowid = rows[-1][0]
+                for row in rows:
+                    yield row[1]
+        finally:
+            conn.close()
+
+    def is_complete(self):
+        with self.lock:
+            has_url = self.conn.execute("SELECT 1 FROM urls LIMIT 1").fetchone()
+            has_pending = self.conn.execute("SELECT 1 FROM urls WHERE status IN (?, ?) LIMIT 1",
+                                            (STATUS_PENDING, STATUS_RETRY)).fetchone()
+        return has_url is not None and has_pending is None
+
+    def reset(self):
+        '''
+        Description: 所有内容抓取完成后删除URL记录，页面断点保留
+        '''
+        with self.lock:
+            self.conn.execute("DELETE FROM urls")
+            self.conn.execute("DELETE FROM retries")
+            self._commit()
+
+    def get_checkpoint(self, site):
+        '''
+        Returns:
+            (页面URL, 是否已爬取完成)，没有断点时页面URL为None
+        '''
+        with self.lock:
+            row = self.conn.execute("SELECT page_url, finished FROM checkpoints WHERE site = ?", (site,)).fetchone()
+        if row is None:
+            #兼容旧版本的页面断点文件
+            return read_history_page_file(site)
+        return row[0], bool(row[1])
+
+    def save_checkpoint(self, site, page_url, finished = False):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO checkpoints (site, page_url, finished, updated_at) "
+                                "VALUES (?, ?, ?, ?)", (site, page_url, int(finished), time.time()))
+            self._commit()
+
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self.closed = True
+            self.conn.close()
@@ -0,0 +1,250 @@
+'''
+本文件实现了图片去重相关的索引：基于感知哈希的近似重复图片索引，用于替代逐对比较RGB直方图的去重方式，
+图片哈希存放在BK树中，按汉明距离查找近邻，整体复杂度约为n·log n；以及下载时使用的内容哈希索引，
+用于在写入文件前发现字节完全相同的图片
+'''
+import filecmp
+import logging
+import os
+import threading
+import zlib
+import numpy as np
+import cv2 as cv
+
+import utils
+
+#可选的感知哈希算法
+HASH_FUNCS = {"dhash": utils.compute_dhash, "phash": utils.compute_phash}
+
+class BKTree():
+    '''
+    BK树，按汉明距离组织哈希值，查询时利用三角不等式剪枝
+    '''
+    def __init__(self, distance_func = utils.hamming_distance):
+        self.distance = distance_func
+        self.root = None            #节点格式为: [哈希值, 条目列表, {距离: 子节点}]
+        self.size = 0
+
+    def add(self, key, item):
+        '''
+        Description: 插入哈希值及其对应的条目
+        Args:
+            key: 哈希值
+            item: 条目，一般为图片路径
+        '''
+        self.size += 1
+        if self.root is None:
+            self.root = [key, [item], {}]
+            return
+        node = self.root
+        while True:
+            dist = self.distance(key, node[0])
+            if dist == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = [key, [item], {}]
+                return
+            node = child
+
+    def query(self, key, max_distance):
+        '''
+        Description: 查询与key的距离不超过max_distance的所有条目
+        Returns:
+            [(距离, 条目), ...]
+        '''
+        result = []
+        if self.root is None:
+            return result
+        candidates = [self.root]
+        while candidates:
+            node = candidates.pop()
+            dist = self.distance(key, node[0])
+            if dist <= max_distance:
+                result.extend((dist, item) for item in node[1])
+            for child_dist, child in node[2].items():
+                if dist - max_distance <= child_dist <= dist + max_distance:
+                    candidates.append(child)
+        return result
+
+    def __len__(self):
+        return self.size
+
+class NearDuplicateIndex():
+    '''
+    近似重复图片索引，哈希算法和索引结构均可替换
+    '''
+    def __init__(self, hash_name = "dhash", similarity = 0.95, hash_bits = 64, index = None):
+        '''
+        Description: 初始化函数
+        Args:
+            hash_name: 感知哈希算法，见HASH_FUNCS
+            similarity: 相似度阈值，相似度定义为1 - 汉明距离 / 哈希位数
+            hash_bits: 哈希位数
+            index: 索引结构对象，需实现add(key, item)和query(key, max_distance)，默认为BKTree
+        '''
+        if hash_name not in HASH_FUNCS:
+            raise ValueError("Error parameter: hash_name")
+        self.hash_func = HASH_FUNCS[hash_name]
+        self.max_distance = utils.similarity_to_distance(similarity, hash_bits)
+        self.index = index if index is not None else BKTree()
+
+    def compute_hash_by_path(self, img_path):
+        '''
+        Description: 读取图片并计算哈希，图片无法读取时返回None
+        '''
+        img = cv.imread(img_path)
+        if img is None:
+            return None
+        return self.hash_func(img)
+
+    def add(self, key, item):
+        self.index.add(key, item)
+
+    def find(self, key):
+        '''
+        Description: 查找与key近似重复的条目
+        '''
+        return [item for _, item in self.index.query(key, self.max_distance)]
+
+def find_redundant_imgs(imgs_list, hash_name = "dhash", similarity = 0.95, hashes = None):
+    '''
+    Description: 找出列表中与后面某张图片近似重复的图片，每组重复图片只保留最后一张，
+            与原逐对比较的结果保持一致
+    Args:
+        imgs_list: 图片路径列表
+        hash_name: 感知哈希算法
+        similarity: 相似度阈值
+        hashes: 与imgs_list对应的哈希值列表，为None时读取图片计算
+    Returns:
+        需要移除的图片路径列表
+    '''
+    index = NearDuplicateIndex(hash_name, similarity)
+    if hashes is None:
+        hashes = [index.compute_hash_by_path(img) for img in imgs_list]
+    redundant = []
+    #倒序遍历，查询时索引中只包含排在当前图片之后的图片
+    for img, key in zip(reversed(imgs_list), reversed(hashes)):
+        if key is None:
+            logging.error("%s 无法读取，跳过去重" % (img))
+            continue
+        if index.find(key):
+            redundant.append(img)
+        index.add(key, img)
+    redundant.reverse()
+    return redundant
+
+def find_redundant_imgs_by_hist(imgs_list, hists, similarity = 0.95, block_size = 256):
+    '''
+    Description: 使用RGB直方图批量比较找出重复图片，规则与find_redundant_imgs相同
+    Args:
+        imgs_list: 图片路径列表
+        hists: 与imgs_list对应的直方图，形状为(N, 3, 256)
+        similarity: 相似度阈值
+        block_size: 每次参与比较的行数
+    Returns:
+        需要移除的图片路径列表
+    '''
+    redundant = []
+    for start in range(0, len(imgs_list), block_size):
+        #只和排在自己后面的图片比较
+        sim = utils.batch_hist_similarity(hists[start:start + block_size], hists[start + 1:])
+        later = np.arange(start + 1, len(imgs_list))[None, :] > np.arange(start, start + len(sim))[:, None]
+        for i in np.nonzero(((sim > similarity) & later).any(axis = 1))[0]:
+            redundant.append(imgs_list[start + i])
+    return redundant
+
+def find_redundant_imgs_in_store(imgs_list, store, method = "dhash", similarity = 0.95,
+                                extract_func = None):
+    '''
+    Description: 先同步特征存储，再从存储中读取特征进行去重
+    Args:
+        imgs_list: 图片路径列表
+        store: featurestore.FeatureStore对象
+        method: 去重方式，"dhash"、"phash"或"rgb_hist"
+        similarity: 相似度阈值
+        extract_func: 批量提取特征的函数，见FeatureStore.sync
+    Returns:
+        需要移除的图片路径列表
+    '''
+    unreadable = set(store.sync(imgs_list, extract_func))
+    for img in unreadable:
+        logging.error("%s 无法读取，跳过去重" % (img))
+    imgs_list = [img for img in imgs_list if img in store]
+    if method == "rgb_hist":
+        return find_redundant_imgs_by_hist(imgs_list, store.get_hists(imgs_list), similarity)
+    return find_redundant_imgs(imgs_list, method, similarity, store.get_hashes(imgs_list, method))
+
+class ContentHashIndex():
+    '''
+    图片内容哈希索引，以(文件大小, CRC32)为键，用于在写入文件前发现字节完全相同的图片，
+    索引以追加方式保存在文本文件中，每行格式为: "大小\\tCRC32\\t文件路径"
+    '''
+    #内容相同的图片按键加锁，保证查找和保存是一个原子操作，不同键分散到多个锁上，互不等待
+    KEY_LOCK_NUM = 64
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.lock = threading.Lock()
+        self.key_locks = [threading.Lock() for _ in range(self.KEY_LOCK_NUM)]
+        self.index = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) != 3:
+                        continue
+                    self.index.setdefault((int(fields[0]), int(fields[1])), []).append(fields[2])
+
+    @staticmethod
+    def compute_key(data):
+        return (len(data), zlib.crc32(data))
+
+    def find(self, key, file_name):
+        '''
+        Description: 查找内容与file_name完全相同的已保存文件
+        Args:
+            key: (文件大小, CRC32)
+            file_name: 待比较的文件，一般为下载中的临时文件
+        Returns:
+            已保存文件路径，不存在时返回None
+        '''
+        with self.lock:
+            candidates = list(self.index.get(key, ()))
+        for path in candidates:
+            #CRC32可能冲突，且文件可能已被去重流程移走，需逐字节确认
+            try:
+                if os.path.getsize(path) == key[0] and filecmp.cmp(path, file_name, shallow = False):
+                    return path
+            except OSError:
+                continue
+        return None
+
+    def add(self, key, path):
+        '''
+        Description: 记录新保存的文件
+        '''
+        with self.lock:
+            self.index.setdefault(key, []).append(path)
+            with open(self.index_file, "a") as f:
+                f.write("%d\t%d\t%s\n" % (key[0], key[1], path))
+
+    def find_or_store(self, key, file_name, store_func):
+        '''
+        Description: 查找内容与file_name完全相同的已保存文件，不存在时调用store_func保存并记录，
+                查找和保存在同一个键锁中完成，多个线程同时保存相同内容时只有第一个会保存，其他线程能找到该文件
+        Args:
+            key: (文件大小, CRC32)
+            file_name: 待比较的文件，一般为下载中的临时文件
+            store_func: 保存文件的函数，返回保存后的文件路径
+        Returns:
+            (文件路径, 是否为本次保存)
+        '''
+        with self.key_locks[hash(key) % self.KEY_LOCK_NUM]:
+            exist_file = self.find(key, file_name)
+            if exist_file is not None:
+                return exist_file, False
+            path = store_func()
+            self.add(key, path)
+            return path, True
@@ -10,6 +10,12 @@ from basespiderweb import BaseSpiderWeb
 import time
 
 class DogPileSpiderWeb(BaseSpiderWeb):
+    #原图URL为每个图片结果中链接的href属性
+    original_url_rules = [(".image", "href", ".link")]
+    #结果页面由服务端生成，可使用HTTP抓取模式
+    http_url = "http://www.dogpile.com/serp?qc=images&q={keywords}"
+    next_page_rule = (".pagination__num--next", "href")
+
     def __init__(self, put_url_2_queue_func, get_img_func = None, dev_mode = True,
                     image_folder = ".", keywrods = ""):
         BaseSpiderWeb.__init__(self, "DogPile", "http://www.dogpile.com/?qc=images",
@@ -41,35 +47,6 @@ class DogPileSpiderWeb(BaseSpiderWeb):
             return False
         return True
 
-    def get_original_urls_this_page(self):
-        '''
-        Description: 直接从搜索的主页面获取原图URL
-        Returns: 
-            url: 从新页面上获取到的一张原图片的URL
-            None: 未获取到图片URL
-        '''
-        urls = []
-        try:
-            image_divs = self.driver.find_elements_by_class_name("image")
-            if image_divs is None:
-                logging.error("%s error: %s" %(self.name, e))
-                return urls
-
-            for img_div in image_divs:
-                try:
-                    img_a = img_div.find_element_by_class_name("link")
-                    if img_a is None:
-                        logging.error("%s error: %s" %(self.name, "img_a is None"))
-                        continue
-                    urls.append(img_a.get_attribute("href"))
-                except exception.NoSuchElementException as e:
-                    logging.error("%s error: %s" %(self.name, e))
-        except exception.NoSuchElementException as e:
-            logging.error("%s error: %s" %(self.name, e))
-            return urls
-
-        return urls
-
     def goto_next_page(self):
         try:
             next_btn = self.driver.find_element_by_css_selector("[class='pagination__num pagination__num--next-prev pagination__num--next']")
@@ -0,0 +1,158 @@
+'''
+本文件实现了所有网站共用的WebDriver池，由MasterSpider创建和关闭，网站开始爬取时从池中获取浏览器，
+爬取结束后归还，归还时清除cookie、本地存储、屏蔽的URL并关闭多余的窗口，选项相同的网站可复用已启动的浏览器，
+池中浏览器总数有上限，从而浏览器的启动时间和内存占用不再随网站数量增长
+'''
+import json
+import logging
+import threading
+import time
+
+try:
+    from selenium import webdriver
+except ImportError:
+    webdriver = None
+
+def get_options_key(options):
+    '''
+    Description: 根据ChromeOptions生成浏览器的标识，标识相同的选项启动的浏览器可以互相替代
+    '''
+    return json.dumps({"arguments": sorted(options.arguments),
+                        "experimental_options": options.experimental_options,
+                        "extensions": sorted(options.extensions),
+                        "binary_location": options.binary_location}, sort_keys = True, default = str)
+
+class DriverPool():
+    '''
+    WebDriver池，线程安全，空闲的浏览器按选项标识保存，获取时优先复用标识相同的空闲浏览器，
+    浏览器数量达到上限时关闭最久未使用的其他选项的空闲浏览器，没有空闲浏览器时等待其他网站归还
+    '''
+    def __init__(self, max_browsers):
+        '''
+        Description: 初始化函数
+        Args:
+            max_browsers: 同时存在的最大浏览器数量，包括使用中和空闲的浏览器
+        '''
+        self.max_browsers = max(1, max_browsers)
+        self.cond = threading.Condition()
+        self.idle = []                  #空闲浏览器列表，元素为(选项标识, driver)，按归还顺序排列
+        self.in_use = {}                #id(driver) -> (选项标识, driver)
+        self.closed = False
+
+    def _count(self):
+        return len(self.idle) + len(self.in_use)
+
+    def acquire(self, options, timeout = None):
+        '''
+        Description: 获取一个使用指定选项启动的浏览器
+        Args:
+            options: ChromeOptions对象
+            timeout: 没有可用浏览器时最长等待时间（秒），为None时一直等待
+        Returns:
+            driver对象，超时返回None
+        '''
+        if webdriver is None:
+            raise ImportError("DriverPool requires selenium")
+        key = get_options_key(options)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                if self.closed:
+                    raise RuntimeError("DriverPool is closed")
+                #优先复用最近归还的相同选项的浏览器
+                for i in range(len(self.idle) - 1, -1, -1):
+                    if self.idle[i][0] == key:
+                        _, driver = self.idle.pop(i)
+                        self.in_use[id(driver)] = (key, driver)
+                        return driver
+                evicted = None
+                if self._count() >= self.max_browsers and self.idle:
+                    _, evicted = self.idle.pop(0)
+                if self._count() < self.max_browsers:
+                    #先占用名额，在锁外启动浏览器
+                    placeholder = object()
+                    self.in_use[id(placeholder)] = (key, None)
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+        if evicted is not None:
+            self._quit(evicted)
+        try:
+            driver = webdriver.Chrome(chrome_options = options)
+        except Exception:
+            with self.cond:
+                del self.in_use[id(placeholder)]
+                self.cond.notify()
+            raise
+        with self.cond:
+            del self.in_use[id(placeholder)]
+            self.in_use[id(driver)] = (key, driver)
+            logging.info("启动新的浏览器，当前浏览器数量: %d" % (self._count()))
+        return driver
+
+    def release(self, driver):
+        '''
+        Description: 归还浏览器，重置浏览器状态后放入空闲列表，重置失败时关闭该浏览器
+        '''
+        with self.cond:
+            key, _ = self.in_use.get(id(driver), (None, None))
+        reusable = key is not None and not self.closed and self._reset(driver)
+        if not reusable:
+            self._quit(driver)
+        with self.cond:
+            self.in_use.pop(id(driver), None)
+            if reusable and not self.closed:
+                self.idle.append((key, driver))
+            self.cond.notify()
+
+    def _reset(self, driver):
+        '''
+        Description: 清除上一个网站留下的状态，只保留一个空白窗口，浏览器缓存保留以加快之后的页面加载
+        Returns:
+            True: 重置成功，False: 浏览器已不可用
+        '''
+        try:
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            try:
+                #清除上一个网站设置的屏蔽URL
+                driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+            except Exception:
+                pass
+            try:
+                driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+            except Exception:
+                #当前页面不允许访问存储时忽略
+                pass
+            try:
+                #清除所有域名的cookie，delete_all_cookies只能清除当前域名的cookie
+                driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            except Exception:
+                driver.delete_all_cookies()
+            driver.get("about:blank")
+            return True
+        except Exception as e:
+            logging.error("重置浏览器出错，关闭该浏览器: %s" % (e))
+            return False
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.error("关闭浏览器出错: %s" % (e))
+
+    def close(self):
+        '''
+        Description: 关闭所有空闲的浏览器，之后归还的浏览器直接关闭
+        '''
+        with self.cond:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.cond.notify_all()
+        for _, driver in idle:
+            self._quit(driver)
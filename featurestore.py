@@ -0,0 +1,180 @@
+'''
+本文件实现了去重特征的持久化存储，图片的RGB直方图和感知哈希保存在内存映射的numpy数组中，
+旁边的索引文件记录每个图片的路径、修改时间、大小以及所在行，再次去重时只需为新增或
+修改过的图片提取特征，其余图片直接从内存映射中读取，不再调用cv.imread
+'''
+import json
+import logging
+import multiprocessing
+import os
+import numpy as np
+
+import utils
+
+#哈希列的顺序
+HASH_COLUMNS = {"dhash": 0, "phash": 1}
+
+def extract_features_parallel(paths, worker_num = None, chunk_size = 64):
+    '''
+    Description: 使用进程池分块解码图片并提取特征，子进程只返回直方图和哈希值，
+            不回传解码后的图像数据
+    Args:
+        paths: 图片路径列表
+        worker_num: 进程数量，为None时使用CPU核数，小于等于1时在当前进程中提取
+        chunk_size: 每次分配给子进程的图片数量
+    Returns:
+        与paths对应的utils.extract_features结果列表
+    '''
+    if worker_num is None:
+        worker_num = os.cpu_count() or 1
+    worker_num = min(worker_num, (len(paths) + chunk_size - 1) // chunk_size)
+    if worker_num <= 1:
+        return [utils.extract_features(p) for p in paths]
+    with multiprocessing.Pool(worker_num) as pool:
+        return list(pool.imap(utils.extract_features, paths, chunksize = chunk_size))
+
+class FeatureStore():
+    '''
+    去重特征存储，存储目录中包含:
+        hists.npy: 形状为(容量, 3, 256)的float32直方图
+        hashes.npy: 形状为(容量, 2)的uint64哈希值，列顺序见HASH_COLUMNS
+        index.json: {"capacity": 容量, "entries": {路径: [行号, mtime_ns, 大小]}}
+    '''
+    def __init__(self, store_dir, init_capacity = 1024):
+        self.store_dir = store_dir
+        if not os.path.isdir(self.store_dir):
+            os.makedirs(self.store_dir)
+        self.hists_file = os.path.join(self.store_dir, "hists.npy")
+        self.hashes_file = os.path.join(self.store_dir, "hashes.npy")
+        self.index_file = os.path.join(self.store_dir, "index.json")
+
+        self.entries = {}
+        capacity = init_capacity
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file) as f:
+                    index = json.load(f)
+                self.entries = index["entries"]
+                capacity = index["capacity"]
+            except (ValueError, KeyError) as e:
+                logging.error("特征索引文件 %s 损坏，重新建立: %s" % (self.index_file, e))
+                self.entries = {}
+        if self.entries and os.path.exists(self.hists_file) and os.path.exists(self.hashes_file):
+            self.hists = np.lib.format.open_memmap(self.hists_file, mode = "r+")
+            self.hashes = np.lib.format.open_memmap(self.hashes_file, mode = "r+")
+            #扩容时在替换两个数组文件之间中断，两个数组长度不同，重新建立
+            if len(self.hists) != len(self.hashes):
+                logging.error("特征数组 %s 与 %s 长度不一致，重新建立" % (self.hists_file, self.hashes_file))
+                del self.hists, self.hashes
+                self.entries = {}
+                self.hists, self.hashes = self._create_arrays(capacity)
+        else:
+            self.entries = {}
+            self.hists, self.hashes = self._create_arrays(capacity)
+        self.free_rows = sorted(set(range(len(self.hists))) - {e[0] for e in self.entries.values()},
+                                reverse = True)
+
+    def _create_arrays(self, capacity, suffix = ""):
+        hists = np.lib.format.open_memmap(self.hists_file + suffix, mode = "w+",
+                                            dtype = np.float32, shape = (capacity, 3, 256))
+        hashes = np.lib.format.open_memmap(self.hashes_file + suffix, mode = "w+",
+                                            dtype = np.uint64, shape = (capacity, len(HASH_COLUMNS)))
+        return hists, hashes
+
+    def _grow(self):
+        '''
+        Description: 容量不足时将数组扩容为原来的两倍，扩容后的数组先写入临时文件，再原子替换原文件，
+                最后写入索引文件，任何时刻中断时索引指向的行在磁盘上的数组中都保存着原有的特征
+        '''
+        old_capacity = len(self.hists)
+        hists, hashes = self._create_arrays(old_capacity * 2, ".tmp")
+        hists[:old_capacity] = self.hists
+        hashes[:old_capacity] = self.hashes
+        hists.flush()
+        hashes.flush()
+        #Windows下无法替换仍被映射的文件，替换前先关闭所有内存映射
+        del hists, hashes, self.hists, self.hashes
+        os.replace(self.hists_file + ".tmp", self.hists_file)
+        os.replace(self.hashes_file + ".tmp", self.hashes_file)
+        self.hists = np.lib.format.open_memmap(self.hists_file, mode = "r+")
+        self.hashes = np.lib.format.open_memmap(self.hashes_file, mode = "r+")
+        self.free_rows = list(range(old_capacity * 2 - 1, old_capacity - 1, -1)) + self.free_rows
+        self.save()
+
+    def _alloc_row(self):
+        if not self.free_rows:
+            self._grow()
+        return self.free_rows.pop()
+
+    def sync(self, paths, extract_func = None):
+        '''
+        Description: 使存储与paths中的图片保持一致，只为新增或修改过的图片提取特征，
+                不在paths中的图片从存储中删除
+        Args:
+            paths: 当前所有图片路径
+            extract_func: 批量提取特征的函数，接受路径列表，返回与之对应的
+                    utils.extract_features结果列表，默认在当前线程中逐个提取
+        Returns:
+            无法读取的图片路径列表
+        '''
+        stats = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = (st.st_mtime_ns, st.st_size)
+
+        for path in [p for p in self.entries if p not in stats]:
+            self.free_rows.append(self.entries.pop(path)[0])
+
+        changed = [p for p, st in stats.items()
+                    if p not in self.entries or tuple(self.entries[p][1:]) != st]
+        if extract_func is None:
+            features_list = [utils.extract_features(p) for p in changed]
+        else:
+            features_list = extract_func(changed)
+
+        unreadable = []
+        for path, features in zip(changed, features_list):
+            if features is None:
+                unreadable.append(path)
+                if path in self.entries:
+                    self.free_rows.append(self.entries.pop(path)[0])
+                continue
+            row = self.entries[path][0] if path in self.entries else self._alloc_row()
+            hist, dhash, phash = features
+            self.hists[row] = hist
+            self.hashes[row, HASH_COLUMNS["dhash"]] = dhash
+            self.hashes[row, HASH_COLUMNS["phash"]] = phash
+            self.entries[path] = [row] + list(stats[path])
+        logging.info("特征存储: 共%d张图片，本次提取%d张" % (len(self.entries), len(changed)))
+        self.save()
+        return unreadable
+
+    def save(self):
+        '''
+        Description: 将数组刷新到磁盘，再以原子替换的方式写入索引文件
+        '''
+        self.hists.flush()
+        self.hashes.flush()
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"capacity": len(self.hists), "entries": self.entries}, f)
+        os.replace(tmp_file, self.index_file)
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def get_hists(self, paths):
+        '''
+        Description: 读取paths对应的直方图，形状为(N, 3, 256)
+        '''
+        return self.hists[[self.entries[p][0] for p in paths]]
+
+    def get_hashes(self, paths, hash_name):
+        '''
+        Description: 读取paths对应的哈希值列表
+        '''
+        column = self.hashes[:, HASH_COLUMNS[hash_name]]
+        return [int(column[self.entries[p][0]]) for p in paths]
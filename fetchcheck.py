@@ -0,0 +1,70 @@
+'''
+本文件使用fixtures目录中保存的结果页面检查HTTP抓取模式的parse_page，不需要网络和浏览器，
+网站页面结构改变后更新对应的页面文件和期望结果即可，例如：
+    python fetchcheck.py
+'''
+import logging
+import os
+import sys
+
+import requests
+
+import chinasospiderweb
+import dogpilespiderweb
+from basespiderweb import BeautifulSoup
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def load_response(file_name, url):
+    '''
+    Description: 用保存的页面文件构造requests.Response，与HTTP抓取模式请求得到的响应相同
+    '''
+    response = requests.models.Response()
+    with open(os.path.join(FIXTURE_DIR, file_name), "rb") as f:
+        response._content = f.read()
+    response.status_code = 200
+    response.encoding = "utf-8"
+    response.url = url
+    return response
+
+def check_dogpile():
+    web = dogpilespiderweb.DogPileSpiderWeb(lambda url: None, lambda url, cookies = None: None)
+    response = load_response("dogpile-serp.html", "http://www.dogpile.com/serp?qc=images&q=cat")
+    urls, next_page_url = web.parse_page(response)
+    #每个结果只取第一个链接，来源网站链接和没有链接的结果不应出现
+    assert urls == [
+        "http://pic22.photophoto.cn/20120307/0034034867250139_b.jpg",
+        "http://pic96.nipic.com/file/20160426/21376910_162454207000_2.jpg",
+        "http://www.dogpile.com/serp/redirect?u=http%3A%2F%2Fimg.redocn.com%2Fsheying%2F20140808%2Fganjingdemihehemian_2867145.jpg",
+    ], urls
+    assert next_page_url == "http://www.dogpile.com/serp?qc=images&q=cat&page=2", next_page_url
+
+def check_chinaso():
+    web = chinasospiderweb.ChinasoSpiderWeb(lambda url: None, lambda url, cookies = None: None)
+    response = load_response("chinaso-getpic.json", "http://image.chinaso.com/getpic?rn=50&st=0&q=cat")
+    urls, next_page_url = web.parse_page(response)
+    assert urls == [
+        "http://pic7.nipic.com/20100608/280013_130614029200_2.jpg",
+        "http://pic21.photophoto.cn/20111213/0034034487200491_b.jpg",
+        "http://file20.mafengwo.net/M00/51/72/wKgB3FYs76SAYKWbAB3PatlQSNU11.jpeg",
+    ], urls
+    assert next_page_url == "http://image.chinaso.com/getpic?rn=50&st=50&q=cat", next_page_url
+    #total为120，从st=100开始的一页是最后一页
+    response = load_response("chinaso-getpic.json", "http://image.chinaso.com/getpic?rn=50&st=100&q=cat")
+    urls, next_page_url = web.parse_page(response)
+    assert next_page_url is None, next_page_url
+
+def main():
+    logging.basicConfig(level = logging.INFO, format = "%(asctime)s %(levelname)s %(message)s")
+    checks = [check_chinaso]
+    if BeautifulSoup is None:
+        logging.warning("未安装beautifulsoup4，跳过DogPile页面检查")
+    else:
+        checks.append(check_dogpile)
+    for check in checks:
+        check()
+        logging.info("%s 通过" % (check.__name__))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+'''
+本文件实现了按主机调度的URL任务队列（frontier），替代单一的FIFO队列，
+每个主机有独立的子队列，按轮询（可加权）的方式分发任务，并使用令牌桶限制每个主机的请求频率，
+避免同一主机的大量URL占满所有下载线程，导致被网站限流而其他主机的任务却在等待
+'''
+import collections
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+class TokenBucket():
+    '''
+    令牌桶，rate为每秒补充的令牌数，burst为桶容量
+    '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def try_consume(self, now):
+        '''
+        Description: 尝试消耗一个令牌
+        Returns:
+            0: 消耗成功
+            大于0的数: 令牌不足，需要等待的秒数
+        '''
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class HostFrontier():
+    '''
+    按主机调度的有界任务队列，接口与queue.Queue的put/get/qsize/empty保持一致，线程安全，
+    关闭后get返回None作为下载线程退出的信号
+    '''
+    def __init__(self, rate_per_host = None, burst = 1, weights = None, maxsize = 0):
+        '''
+        Description: 初始化函数
+        Args:
+            rate_per_host: 每个主机每秒最多分发的URL数量，为None时不限速
+            burst: 令牌桶容量，即每个主机允许的突发请求数量
+            weights: 主机权重字典，格式为{主机: 权重}，轮询到该主机时连续分发权重个URL，默认为1
+            maxsize: 队列中最多保存的URL数量，队列满时put阻塞，从而让URL生产者等待下载线程，小于等于0时不限制
+        '''
+        self.rate_per_host = rate_per_host
+        self.burst = max(1, burst)
+        self.weights = weights or {}
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)          #队列非空或已关闭时通知消费者
+        self.not_full = threading.Condition(self.lock)      #队列有空位时通知生产者
+        self.closed = False
+        self.host_queues = {}                       #主机 -> 该主机待分发的URL
+        self.ready_hosts = collections.deque()     #有待分发URL的主机，按轮询顺序排列
+        self.buckets = {}                          #主机 -> 令牌桶
+        self.served = 0                            #当前主机在本轮已分发的URL数量
+        self.size = 0
+
+    @staticmethod
+    def get_host(url):
+        return urlsplit(url).netloc.lower()
+
+    def _append(self, url):
+        '''
+        Description: 将URL放入所属主机的子队列，调用者需持有self.cond
+        '''
+        host = self.get_host(url)
+        host_queue = self.host_queues.get(host)
+        if host_queue is None:
+            host_queue = collections.deque()
+            self.host_queues[host] = host_queue
+            self.ready_hosts.append(host)
+        host_queue.append(url)
+        self.size += 1
+
+    def _wait_not_full(self):
+        '''
+        Description: 队列满时阻塞，队列关闭后不再阻塞，调用者需持有self.lock
+        '''
+        while self.maxsize > 0 and self.size >= self.maxsize and not self.closed:
+            self.not_full.wait()
+
+    def put(self, url):
+        '''
+        Description: 放入一个URL，队列满时阻塞直到下载线程取出URL
+        '''
+        with self.lock:
+            self._wait_not_full()
+            self._append(url)
+            self.cond.notify()
+
+    def put_many(self, urls):
+        '''
+        Description: 批量放入URL，队列有空位时一次放入尽可能多的URL
+        '''
+        with self.lock:
+            for url in urls:
+                if self.maxsize > 0 and self.size >= self.maxsize and not self.closed:
+                    self.cond.notify_all()
+                    self._wait_not_full()
+                self._append(url)
+            self.cond.notify_all()
+
+    def close(self):
+        '''
+        Description: 关闭队列，之后队列中剩余的URL分发完后get不再阻塞，而是返回None通知下载线程退出
+        '''
+        with self.lock:
+            self.closed = True
+            self.cond.notify_all()
+            self.not_full.notify_all()
+
+    def _try_pop(self, now):
+        '''
+        Description: 按轮询顺序查找有令牌的主机并取出一个URL
+        Returns:
+            (url, 0): 取出成功
+            (None, 等待秒数): 所有主机都没有令牌，等待秒数为最早可获得令牌的时间，没有任何URL时为None
+        '''
+        min_wait = None
+        for _ in range(len(self.ready_hosts)):
+            host = self.ready_hosts[0]
+            wait = 0
+            if self.rate_per_host:
+                bucket = self.buckets.get(host)
+                if bucket is None:
+                    bucket = TokenBucket(self.rate_per_host, self.burst)
+                    self.buckets[host] = bucket
+                wait = bucket.try_consume(now)
+            if wait > 0:
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+                self.served = 0
+                self.ready_hosts.rotate(-1)
+                continue
+            host_queue = self.host_queues[host]
+            url = host_queue.popleft()
+            self.size -= 1
+            self.not_full.notify()
+            self.served += 1
+            if not host_queue:
+                del self.host_queues[host]
+                self.ready_hosts.popleft()
+                self.served = 0
+            elif self.served >= self.weights.get(host, 1):
+                self.ready_hosts.rotate(-1)
+                self.served = 0
+            return url, 0
+        return None, min_wait
+
+    def get(self, block = True, timeout = None):
+        '''
+        Description: 获取一个URL，没有可分发的URL时阻塞
+        Args:
+            block: 是否阻塞
+            timeout: 最长阻塞时间（秒），为None时一直阻塞
+        Returns:
+            URL，队列已关闭且所有URL都已分发时返回None
+        Raises:
+            queue.Empty: 超时或非阻塞模式下没有可分发的URL
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                url, wait = self._try_pop(now)
+                if url is not None:
+                    return url
+                if self.closed and self.size == 0:
+                    return None
+                if not block:
+                    raise queue.Empty
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise queue.Empty
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.cond.wait(wait)
+
+    def qsize(self):
+        with self.cond:
+            return self.size
+
+    def empty(self):
+        return self.qsize() == 0
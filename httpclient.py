@@ -0,0 +1,73 @@
+'''
+本文件实现了HTTP连接复用相关的工具，每个线程持有一个长连接的requests.Session，
+同一主机的请求复用已建立的TCP/TLS连接，避免每次下载都重新握手
+'''
+import http.cookiejar
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+class _RejectAllCookiePolicy(http.cookiejar.DefaultCookiePolicy):
+    '''
+    拒绝保存响应中所有cookie的策略
+    '''
+    def set_ok(self, cookie, request):
+        return False
+
+def create_session(headers = None, pool_connections = None, pool_maxsize = None, keep_cookies = True):
+    '''
+    Description: 创建带连接池的Session
+    Args:
+        headers: Session默认使用的header
+        pool_connections: 缓存连接池的主机数量，默认使用config.http_pool_connections
+        pool_maxsize: 每个主机连接池中保持的最大连接数，默认使用config.http_pool_maxsize
+        keep_cookies: 是否保存响应中的cookie，为False时每个请求只使用调用者传入的cookies参数，
+                与不使用Session时一样不会把一个主机的cookie发送给其他主机
+    Returns:
+        requests.Session对象
+    '''
+    sess = requests.Session()
+    if not keep_cookies:
+        sess.cookies.set_policy(_RejectAllCookiePolicy())
+    adapter = HTTPAdapter(pool_connections = pool_connections or config.http_pool_connections,
+                            pool_maxsize = pool_maxsize or config.http_pool_maxsize)
+    sess.mount("http://", adapter)
+    sess.mount("https://", adapter)
+    if headers:
+        sess.headers.update(headers)
+    return sess
+
+class ThreadLocalSessions():
+    '''
+    为每个线程分别维护一个Session，requests.Session不保证线程安全，因此不在线程间共享，
+    Session用于下载各个主机的图片，默认不保存cookie
+    '''
+    def __init__(self, headers = None, keep_cookies = False):
+        self.headers = headers
+        self.keep_cookies = keep_cookies
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sessions = []
+
+    def get(self):
+        '''
+        Description: 获取当前线程的Session，不存在时创建
+        '''
+        sess = getattr(self.local, "session", None)
+        if sess is None:
+            sess = create_session(self.headers, keep_cookies = self.keep_cookies)
+            self.local.session = sess
+            with self.lock:
+                self.sessions.append(sess)
+        return sess
+
+    def close(self):
+        '''
+        Description: 关闭所有线程的Session
+        '''
+        with self.lock:
+            for sess in self.sessions:
+                sess.close()
+            self.sessions = []
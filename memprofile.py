@@ -0,0 +1,197 @@
+'''
+本文件实现了按阶段统计内存分配的分析模式，使用tracemalloc定期获取快照，按调用栈中的模块将内存分配
+划分到URL发现（discovery）、图片下载（download）和图片去重（dedup）三个阶段，每次快照将各阶段与上一次快照
+相比增长最多的分配位置写入文件，程序结束时记录各阶段的峰值内存，
+未开启时不启动tracemalloc和后台线程，没有任何额外开销
+'''
+import fnmatch
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+import config
+
+#本项目模块所在的文件夹，本项目的模块按完整路径匹配，避免第三方库中的同名模块（如requests/utils.py）被计入错误的阶段
+REPO_DIR = os.path.dirname(os.path.abspath(__file__)).replace("\\", "/")
+
+def _repo_modules(*names):
+    return [REPO_DIR + "/" + name for name in names]
+
+#各阶段包含的模块，按dedup、discovery、download的顺序划分，调用栈中出现前一阶段模块的内存分配不再计入后面的阶段，
+#已发现URL的集合、布隆过滤器和任务队列计入discovery，下载时的内容去重索引计入dedup，
+#第三方库使用通配符匹配其包目录，
+#MasterSpider在读取爬取状态之前开始统计，在爬取状态读取完成、URL发现完成和下载完成后各获取一次快照，
+#去重进程池中的内存分配不在本进程中，无法统计
+STAGE_PATTERNS = [
+    ("dedup", _repo_modules("dedup.py", "featurestore.py", "utils.py")),
+    ("discovery", _repo_modules("*spiderweb*.py", "crawlstate.py", "urlfilter.py", "frontier.py") +
+                    ["*/selenium/*"]),
+    ("download", _repo_modules("spider.py", "asyncspider.py", "httpclient.py", "retryqueue.py") +
+                    ["*/requests/*", "*/urllib3/*", "*/aiohttp/*"]),
+]
+STAGES = [stage for stage, _ in STAGE_PATTERNS]
+
+class MemoryProfiler(threading.Thread):
+    '''
+    后台线程，每隔interval秒获取一次快照，也可以在阶段结束时由调用者调用take_snapshot获取快照，
+    分配位置按阶段统计，tracemalloc.Filter在调用栈较深时逐帧匹配通配符，速度太慢，
+    因此按文件名缓存匹配结果，并按调用栈缓存所属阶段
+    '''
+    def __init__(self, output_dir, interval, top_n = 20, nframe = 30, key_type = "lineno"):
+        '''
+        Description: 初始化函数
+        Args:
+            output_dir: 保存分析结果的文件夹
+            interval: 定期获取快照的时间间隔（秒）
+            top_n: 每个阶段写入文件的分配位置数量
+            nframe: tracemalloc记录的调用栈深度，深度不够时无法按模块划分阶段
+            key_type: 分配位置的统计方式，"lineno"、"filename"或"traceback"
+        '''
+        if key_type not in ["lineno", "filename", "traceback"]:
+            raise ValueError("Error parameter: key_type")
+        threading.Thread.__init__(self, daemon = True)
+        #去重时会切换当前目录，因此使用绝对路径
+        self.output_dir = os.path.abspath(output_dir)
+        self.interval = interval
+        self.top_n = top_n
+        self.nframe = nframe
+        self.key_type = key_type
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.seq = 0
+        self.file_ranks = {}                                #文件名 -> 所属阶段在STAGE_PATTERNS中的序号
+        self.last_stats = {stage: {} for stage in STAGES}   #阶段 -> 上一次快照的{分配位置: [字节数, 分配次数]}
+        self.stage_peaks = {stage: 0 for stage in STAGES}
+        self.stage_last = {stage: 0 for stage in STAGES}
+
+    def start(self):
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        tracemalloc.start(self.nframe)
+        threading.Thread.start(self)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.take_snapshot("interval")
+
+    def _file_rank(self, filename):
+        rank = self.file_ranks.get(filename, -1)
+        if rank == -1:
+            rank = None
+            path = filename.replace("\\", "/")
+            for i, (_, patterns) in enumerate(STAGE_PATTERNS):
+                if any(fnmatch.fnmatch(path, pattern) for pattern in patterns):
+                    rank = i
+                    break
+            self.file_ranks[filename] = rank
+        return rank
+
+    def _traceback_stage(self, traceback):
+        ranks = [rank for rank in (self._file_rank(frame.filename) for frame in traceback) if rank is not None]
+        return STAGES[min(ranks)] if ranks else None
+
+    def _group_by_stage(self, snapshot):
+        '''
+        Description: 按阶段和分配位置统计快照中的内存分配
+        Returns:
+            {阶段: {分配位置: [字节数, 分配次数]}}
+        '''
+        stage_stats = {stage: {} for stage in STAGES}
+        traceback_stages = {}
+        for trace in snapshot.traces:
+            traceback = trace.traceback
+            stage = traceback_stages.get(traceback, -1)
+            if stage == -1:
+                stage = self._traceback_stage(traceback)
+                traceback_stages[traceback] = stage
+            if stage is None:
+                continue
+            if self.key_type == "traceback":
+                key = traceback
+            else:
+                frame = traceback[-1]
+                key = (frame.filename, frame.lineno if self.key_type == "lineno" else 0)
+            stat = stage_stats[stage].get(key)
+            if stat is None:
+                stage_stats[stage][key] = [trace.size, 1]
+            else:
+                stat[0] += trace.size
+                stat[1] += 1
+        return stage_stats
+
+    def take_snapshot(self, label):
+        '''
+        Description: 获取一次快照，记录各阶段的内存占用，并将与上一次快照相比变化最大的分配位置写入"序号-标签-阶段.txt"
+        '''
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                return
+            snapshot = tracemalloc.take_snapshot()
+            self.seq += 1
+            for stage, stats in self._group_by_stage(snapshot).items():
+                size = sum(stat[0] for stat in stats.values())
+                self.stage_last[stage] = size
+                self.stage_peaks[stage] = max(self.stage_peaks[stage], size)
+                self._write_stats(stage, label, size, stats, self.last_stats[stage])
+                self.last_stats[stage] = stats
+
+    def _format_key(self, key):
+        if self.key_type == "traceback":
+            return "\n    ".join(key.format(most_recent_first = True))
+        if self.key_type == "lineno":
+            return "%s:%d" % key
+        return key[0]
+
+    def _write_stats(self, stage, label, size, stats, last_stats):
+        diffs = []
+        for key in set(stats) | set(last_stats):
+            cur_size, cur_count = stats.get(key, (0, 0))
+            last_size, last_count = last_stats.get(key, (0, 0))
+            diffs.append((cur_size - last_size, cur_size, cur_count - last_count, cur_count, key))
+        diffs.sort(key = lambda diff: abs(diff[0]), reverse = True)
+        file_name = os.path.join(self.output_dir, "%04d-%s-%s.txt" % (self.seq, label, stage))
+        with open(file_name, "w") as f:
+            f.write("time: %s\nstage: %s\nsize: %.1f KiB\n\n" % (time.strftime("%Y-%m-%d %H:%M:%S"),
+                                                                    stage, size / 1024))
+            for size_diff, cur_size, count_diff, cur_count, key in diffs[:self.top_n]:
+                f.write("%s: size=%.1f KiB (%+.1f KiB), count=%d (%+d)\n" % (self._format_key(key),
+                        cur_size / 1024, size_diff / 1024, cur_count, count_diff))
+
+    def close(self):
+        '''
+        Description: 停止后台线程，获取最后一次快照，并将各阶段的峰值内存写入summary.json
+        '''
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.take_snapshot("final")
+        with self.lock:
+            traced_current, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            summary = {
+                "snapshots": self.seq,
+                "traced_current_bytes": traced_current,
+                "traced_peak_bytes": traced_peak,
+                #各阶段的峰值为所有快照中的最大值
+                "stages": {stage: {"peak_bytes": self.stage_peaks[stage], "last_bytes": self.stage_last[stage]}
+                            for stage in STAGES},
+            }
+        with open(os.path.join(self.output_dir, "summary.json"), "w") as f:
+            json.dump(summary, f, indent = 1)
+        logging.info("内存分析结果已保存到: %s" % (self.output_dir))
+
+def start_profiler():
+    '''
+    Description: 根据config.memprofile_enabled启动内存分析
+    Returns:
+        MemoryProfiler对象，未开启时返回None
+    '''
+    if not config.memprofile_enabled:
+        return None
+    profiler = MemoryProfiler(config.memprofile_dir, config.memprofile_interval, config.memprofile_top_n,
+                                config.memprofile_nframe, config.memprofile_key_type)
+    profiler.start()
+    return profiler
@@ -0,0 +1,320 @@
+'''
+本文件实现了爬虫运行时的监控指标，包括计数器、仪表和直方图，指标可通过本地HTTP端口以Prometheus文本格式获取，
+也可由后台线程定期写入JSON快照文件，从而根据实际的URL发现速度、队列长度、下载速度、下载延迟、
+失败原因以及下载线程的忙闲时间来调整worker_num等参数，只依赖标准库
+'''
+import bisect
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+
+#下载延迟直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+#页面爬取时间直方图的桶上界（秒）
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric():
+    '''
+    指标基类，每组标签值对应一个样本，线程安全
+    '''
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}                #标签值元组 -> 样本值
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames) or any(name not in labels for name in self.labelnames):
+            raise ValueError("Error parameter: labels of %s" % (self.name))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key, extra = None):
+        pairs = list(zip(self.labelnames, key)) + (extra or [])
+        if not pairs:
+            return ""
+        return "{%s}" % (",".join('%s="%s"' % (name, _escape(value)) for name, value in pairs))
+
+    def _items(self):
+        with self.lock:
+            return list(self.values.items())
+
+    def render(self):
+        '''
+        Description: 以Prometheus文本格式输出指标
+        '''
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s %s" % (self.name, self.type_name)]
+        for key, value in self._items():
+            lines.append("%s%s %s" % (self.name, self._format_labels(key), _format_value(value)))
+        return lines
+
+    def snapshot(self):
+        '''
+        Description: 以字典形式输出指标，没有标签时直接为样本值，有标签时键为逗号连接的标签值
+        '''
+        items = self._items()
+        if not self.labelnames:
+            return items[0][1] if items else 0
+        return {",".join(key): value for key, value in items}
+
+    def total(self):
+        return sum(value for _, value in self._items())
+
+class Counter(_Metric):
+    '''
+    只增不减的计数器
+    '''
+    type_name = "counter"
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    '''
+    可增可减的仪表，没有标签时也可以绑定一个函数，获取指标时调用该函数得到当前值
+    '''
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames = ()):
+        _Metric.__init__(self, name, documentation, labelnames)
+        self.func = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, func):
+        self.func = func
+
+    def _items(self):
+        if self.func is not None:
+            try:
+                return [((), self.func())]
+            except Exception as e:
+                logging.error("获取指标%s出错: %s" % (self.name, e))
+                return []
+        return _Metric._items(self)
+
+class Histogram(_Metric):
+    '''
+    直方图，记录样本落在各个桶中的数量、样本总和以及样本数量
+    '''
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets, labelnames = ()):
+        _Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            sample = self.values.get(key)
+            if sample is None:
+                sample = [[0] * len(self.buckets), 0.0, 0]
+                self.values[key] = sample
+            sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def _items(self):
+        with self.lock:
+            return [(key, ([*counts], total, count)) for key, (counts, total, count) in self.values.items()]
+
+    def _quantile(self, q, counts, count):
+        '''
+        Description: 根据桶计数线性插值估算分位数，与Prometheus的histogram_quantile计算方式相同
+        '''
+        if count == 0:
+            return None
+        rank = q * count
+        cumulative = 0
+        for i, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count > 0:
+                upper = self.buckets[i]
+                lower = self.buckets[i - 1] if i > 0 else 0
+                if upper == float("inf"):
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-2]
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s %s" % (self.name, self.type_name)]
+        for key, (counts, total, count) in self._items():
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append("%s_bucket%s %d" % (self.name,
+                            self._format_labels(key, [("le", _format_value(bucket))]), cumulative))
+            lines.append("%s_sum%s %s" % (self.name, self._format_labels(key), _format_value(total)))
+            lines.append("%s_count%s %d" % (self.name, self._format_labels(key), count))
+        return lines
+
+    def snapshot(self):
+        result = {}
+        for key, (counts, total, count) in self._items():
+            result[",".join(key)] = {"count": count, "sum": total,
+                                    "p50": self._quantile(0.5, counts, count),
+                                    "p99": self._quantile(0.99, counts, count)}
+        if not self.labelnames:
+            return result.get("", {"count": 0, "sum": 0.0, "p50": None, "p99": None})
+        return result
+
+    def total(self):
+        return sum(count for _, (_, _, count) in self._items())
+
+class MetricsRegistry():
+    '''
+    指标注册表，保存所有指标并统一输出
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames = ()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames = ()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, buckets, labelnames = ()):
+        return self.register(Histogram(name, documentation, buckets, labelnames))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+#默认注册表和爬虫使用的指标
+REGISTRY = MetricsRegistry()
+
+URLS_DISCOVERED = REGISTRY.counter("imagespider_urls_discovered_total", "各网站获取到的图片URL数量（包括重复URL）", ("site",))
+URLS_QUEUED = REGISTRY.counter("imagespider_urls_queued_total", "新发现并放入任务队列的图片URL数量")
+PAGES_CRAWLED = REGISTRY.counter("imagespider_pages_crawled_total", "各网站已爬取的页面数量", ("site",))
+PAGE_SECONDS = REGISTRY.histogram("imagespider_page_crawl_seconds", "各网站爬取一个页面所用的时间", PAGE_BUCKETS, ("site",))
+SITES_CRAWLING = REGISTRY.gauge("imagespider_sites_crawling", "正在爬取的网站数量")
+QUEUE_DEPTH = REGISTRY.gauge("imagespider_work_queue_depth", "任务队列中等待下载的URL数量")
+RETRY_QUEUE_DEPTH = REGISTRY.gauge("imagespider_retry_queue_depth", "等待重试的URL数量")
+DOWNLOADS = REGISTRY.counter("imagespider_downloads_total", "下载成功的图片数量")
+DUPLICATES = REGISTRY.counter("imagespider_duplicate_images_total", "与已保存图片内容相同的图片数量")
+DOWNLOAD_BYTES = REGISTRY.counter("imagespider_download_bytes_total", "下载成功的图片字节数")
+DOWNLOAD_SECONDS = REGISTRY.histogram("imagespider_download_seconds", "下载成功的图片从发出请求到保存完成所用的时间",
+                                        LATENCY_BUCKETS)
+DOWNLOAD_FAILURES = REGISTRY.counter("imagespider_download_failures_total", "按失败类型统计的下载失败次数", ("kind",))
+DOWNLOADS_INFLIGHT = REGISTRY.gauge("imagespider_downloads_inflight", "正在进行的下载数量")
+WORKER_BUSY = REGISTRY.counter("imagespider_worker_busy_seconds_total", "各下载线程处理任务的时间", ("worker",))
+WORKER_IDLE = REGISTRY.counter("imagespider_worker_idle_seconds_total", "各下载线程等待任务的时间", ("worker",))
+
+def start_http_server(port, host = "127.0.0.1", registry = REGISTRY):
+    '''
+    Description: 在后台线程中启动HTTP服务，以Prometheus文本格式输出指标
+    Returns:
+        http.server.ThreadingHTTPServer对象，调用shutdown()停止服务
+    Raises:
+        OSError: 端口已被占用等
+    '''
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    logging.info("监控指标地址: http://%s:%d/metrics" % (host, port))
+    return server
+
+class SnapshotWriter(threading.Thread):
+    '''
+    后台线程，每隔interval秒将所有指标写入JSON文件，并附带各计数器在这段时间内的每秒增量
+    '''
+    def __init__(self, file_name, interval, registry = REGISTRY):
+        threading.Thread.__init__(self, daemon = True)
+        self.file_name = file_name
+        self.interval = interval
+        self.registry = registry
+        self.stop_event = threading.Event()
+        self.last_totals = {}
+        self.last_time = time.monotonic()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.write()
+
+    def write(self):
+        '''
+        Description: 以原子替换的方式写入一次快照
+        '''
+        now = time.monotonic()
+        elapsed = max(now - self.last_time, 1e-9)
+        with self.registry.lock:
+            counters = [metric for metric in self.registry.metrics if isinstance(metric, Counter)]
+        totals = {metric.name: metric.total() for metric in counters}
+        rates = {name: (total - self.last_totals.get(name, 0)) / elapsed for name, total in totals.items()}
+        self.last_totals = totals
+        self.last_time = now
+        data = {"time": time.time(), "interval": elapsed, "rates": rates, "metrics": self.registry.snapshot()}
+        tmp_file = self.file_name + ".tmp"
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(data, f, ensure_ascii = False, indent = 1)
+            os.replace(tmp_file, self.file_name)
+        except OSError as e:
+            logging.error("写入监控指标快照 %s 出错: %s" % (self.file_name, e))
+
+    def close(self):
+        '''
+        Description: 停止后台线程并写入最后一次快照
+        '''
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.write()
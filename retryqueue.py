@@ -0,0 +1,141 @@
+'''
+本文件实现了下载失败的分类和持久化的延迟重试队列，下载失败按原因分为超时、连接错误、
+4xx、5xx、非图片等类型，可重试的失败按指数退避加随机抖动的时间延迟后重新放入任务队列，
+每种类型有各自的最大尝试次数，超过次数或不可重试的失败记录为永久失败，之后不再请求，
+重试状态保存在爬取状态存储中，程序重启后继续按原计划重试
+'''
+import heapq
+import logging
+import random
+import threading
+import time
+
+import config
+
+#下载失败类型
+FAIL_TIMEOUT = "timeout"
+FAIL_CONNECTION = "connection"
+FAIL_THROTTLED = "throttled"            #408、429
+FAIL_HTTP_4XX = "http_4xx"              #其他非200、非5xx的状态码
+FAIL_HTTP_5XX = "http_5xx"
+FAIL_NOT_IMAGE = "not_image"
+FAIL_TOO_LARGE = "too_large"
+FAIL_OTHER = "other"
+
+class DownloadError(Exception):
+    '''
+    下载失败异常，kind为失败类型
+    '''
+    def __init__(self, kind, message):
+        Exception.__init__(self, message)
+        self.kind = kind
+
+def classify_http_status(status_code):
+    '''
+    Description: 根据非200的HTTP状态码得到失败类型
+    '''
+    if status_code in (408, 429):
+        return FAIL_THROTTLED
+    if 500 <= status_code < 600:
+        return FAIL_HTTP_5XX
+    return FAIL_HTTP_4XX
+
+def compute_backoff(attempts):
+    '''
+    Description: 计算第attempts次失败后的重试延迟（秒），按指数增长并加入±50%的随机抖动
+    '''
+    delay = min(config.retry_backoff_max, config.retry_backoff_base * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.5, 1.5)
+
+class RetryQueue(threading.Thread):
+    '''
+    延迟重试队列，后台线程在url到期后调用put_func将其重新放入任务队列
+    '''
+    def __init__(self, crawl_state, put_func):
+        '''
+        Description: 初始化函数
+        Args:
+            crawl_state: 爬取状态存储对象，用于持久化失败记录
+            put_func: 将url放入任务队列的函数
+        '''
+        threading.Thread.__init__(self, daemon = True)
+        self.crawl_state = crawl_state
+        self.put_func = put_func
+        self.cond = threading.Condition()
+        self.heap = []                  #(到期时间, url)
+        self.attempts = {}              #url -> 已失败次数
+        self.in_transit = 0             #已到期、正在放回任务队列的url数量
+        self.closed = False
+        #读取之前保存的重试计划
+        for url, kind, attempts, next_retry_at in self.crawl_state.iter_retries():
+            self.attempts[url] = attempts
+            self.heap.append((next_retry_at, url))
+        heapq.heapify(self.heap)
+        if self.heap:
+            logging.info("读取到%d个等待重试的url" % (len(self.heap)))
+
+    def record_failure(self, url, kind):
+        '''
+        Description: 记录一次下载失败，可重试时加入延迟队列，否则记录为永久失败
+        Returns:
+            True: 已加入重试队列，False: 永久失败
+        '''
+        with self.cond:
+            attempts = self.attempts.get(url, 0) + 1
+            max_attempts = config.retry_max_attempts.get(kind, 1)
+            if attempts >= max_attempts:
+                self.attempts.pop(url, None)
+                permanent = True
+                next_retry_at = None
+            else:
+                self.attempts[url] = attempts
+                permanent = False
+                next_retry_at = time.time() + compute_backoff(attempts)
+                heapq.heappush(self.heap, (next_retry_at, url))
+                self.cond.notify()
+        self.crawl_state.record_failure(url, kind, attempts, next_retry_at, permanent)
+        if permanent:
+            logging.info("%s 失败%d次(%s)，不再重试" % (url, attempts, kind))
+        return not permanent
+
+    def record_success(self, url):
+        with self.cond:
+            self.attempts.pop(url, None)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.closed:
+                    now = time.time()
+                    if self.heap and self.heap[0][0] <= now:
+                        break
+                    self.cond.wait(self.heap[0][0] - now if self.heap else None)
+                if self.closed:
+                    return
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    due.append(heapq.heappop(self.heap)[1])
+                self.in_transit += len(due)
+            for url in due:
+                self.put_func(url)
+                with self.cond:
+                    self.in_transit -= 1
+
+    def has_due_within(self, seconds):
+        '''
+        Description: 是否有url将在seconds秒内到期，或已到期但还未放回任务队列
+        '''
+        with self.cond:
+            return self.in_transit > 0 or (len(self.heap) > 0 and self.heap[0][0] - time.time() <= seconds)
+
+    def __len__(self):
+        with self.cond:
+            return len(self.heap)
+
+    def close(self):
+        '''
+        Description: 停止后台线程，未到期的url已保存在爬取状态中，下次启动后继续重试
+        '''
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
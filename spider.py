@@ -6,14 +6,59 @@ import urllib.request
 import threading
 import time
 import os
-import queue
 import random
+import hashlib
 import imghdr
 import shutil
+import tempfile
+import zlib
 import requests
+import urllib3
 import config
 
-import utils
+import asyncspider
+import crawlstate
+import dedup
+import driverpool
+import featurestore
+import frontier
+import httpclient
+import memprofile
+import metrics
+import retryqueue
+
+#使用与浏览器相同的header，防止网站反爬虫机制
+DOWNLOAD_HEADERS = {
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,'\
+                    'image/webp,image/apng,*/*;q=0.8',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'Accept-Language': 'zh-CN,zh;q=0.9',
+#        'Cache-Control': 'max-age=0',
+        'Connection': 'keep-alive',
+#        'Upgrade-Insecure-Requests': '1',
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '\
+                        '(KHTML, like Gecko) Chrome/71.0.3578.98 Safari/537.36'}
+
+#判断图片格式需要的文件头字节数
+SNIFF_SIZE = 32
+
+def classify_download_error(e):
+    '''
+    Description: 根据下载过程中抛出的异常得到失败类型，见retryqueue.FAIL_*
+    '''
+    if isinstance(e, retryqueue.DownloadError):
+        return e.kind
+    if isinstance(e, (requests.exceptions.Timeout, TimeoutError)):
+        return retryqueue.FAIL_TIMEOUT
+    #iter_content读取超时时requests抛出的是包装了ReadTimeoutError的ConnectionError
+    if isinstance(e, requests.exceptions.ConnectionError) and e.args and \
+            isinstance(e.args[0], urllib3.exceptions.ReadTimeoutError):
+        return retryqueue.FAIL_TIMEOUT
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, ConnectionError)):
+        return retryqueue.FAIL_CONNECTION
+    if asyncspider.aiohttp is not None and isinstance(e, asyncspider.aiohttp.ClientError):
+        return retryqueue.FAIL_CONNECTION
+    return retryqueue.FAIL_OTHER
 
 class GetImageSpider(threading.Thread):
     '''
@@ -25,42 +70,60 @@ class GetImageSpider(threading.Thread):
         self.get_task = get_task_func
         self.image_folder = image_folder
         self.download_func = download_func
-        self.is_stop = False
 
     def run(self):
         logging.info("开启线程： %d" % (self.ID))
         while True:
+            #get_task阻塞直到获取到url，返回None说明任务队列已关闭并且所有任务都已分发
+            idle_start = time.monotonic()
             url = self.get_task()
-            if self.is_stop and url is None:
+            busy_start = time.monotonic()
+            metrics.WORKER_IDLE.inc(busy_start - idle_start, worker = self.ID)
+            if url is None:
                 break
-            elif url is None:
-                continue
             self.download_func(url)
+            metrics.WORKER_BUSY.inc(time.monotonic() - busy_start, worker = self.ID)
         logging.info("线程： %d 退出" % (self.ID))
-    def stop(self):
-        self.is_stop = True
 
 class GetURLSpider(threading.Thread):
     '''
     工作线程类，专门根据预定义的蜘蛛网（BaseSpiderWeb子类）获取图片URL的工作蜘蛛类，爬取URL的小弟
     '''
     def __init__(self, ID, put_task_func, downloaded_func, Web, dev_mode = True,
-                image_folder = ".", keywrods = ""):
+                image_folder = ".", keywrods = "", crawl_state = None, driver_pool = None):
         threading.Thread.__init__(self)
         self.ID = ID
-        self.web = Web(put_task_func, downloaded_func, 
+        self.put_task_func = put_task_func
+        self.web = Web(lambda url: self._put_task(url), downloaded_func,
                         dev_mode, image_folder, keywrods)
+        self.site = getattr(self.web, "name", self.web.__class__.__name__)
+        #页面断点保存在crawl_state中
+        self.web.crawl_state = crawl_state
+        #浏览器从driver_pool中获取，爬取结束后归还
+        self.web.driver_pool = driver_pool
         self.backend = self.web.download_backend
 
+    def _put_task(self, url):
+        metrics.URLS_DISCOVERED.inc(site = self.site)
+        self.put_task_func(url)
+
     def run(self):
-        self.web.start_crawl()
+        metrics.SITES_CRAWLING.inc()
+        try:
+            self.web.start_crawl()
+        finally:
+            metrics.SITES_CRAWLING.dec()
+            #不再等待对象销毁时关闭浏览器，爬取结束后立即归还，供其他网站使用
+            close_driver = getattr(self.web, "close_driver", None)
+            if close_driver is not None:
+                close_driver()
 
 class MasterSpider():
     '''
     蜘蛛包工头，负责招聘(创建)和管理多个工作蜘蛛小弟
     '''
     def __init__(self, web_class_list, image_folder = ".", 
-                dev_mode = True, worker_num = 10):
+                dev_mode = True, worker_num = 10, download_engine = "thread"):
         '''
         Description: 输出化函数
         Args:
@@ -68,15 +131,38 @@ class MasterSpider():
                         目前支持的只有中文和英语，列表的格式为：[(class1,"chinese"),(class2,"english"),...]，
             image_folder: 保存图片的文件夹
             worker_num: 工作线程数量
+            download_engine: 后台下载引擎，"thread"为worker_num个下载线程；"asyncio"为单个事件循环线程，
+                        并发量由config.async_max_concurrency和config.async_per_host_concurrency控制，
+                        此时worker_num只用来判断是否需要启动后台下载
         '''
+        if download_engine not in ["thread", "asyncio"]:
+            raise ValueError("Error parameter: download_engine")
+        #config.memprofile_enabled为True时按阶段统计内存分配，否则为None，
+        #在读取爬取状态之前开始，从而统计到已发现URL的集合和布隆过滤器
+        self.mem_profiler = memprofile.start_profiler()
         self.dev_mode = dev_mode
         self.worker_num = worker_num
-        self.work_queue = queue.Queue()                 #任务队列，该类为线程安全
+        #任务队列，按主机轮询分发并限制每个主机的请求频率，该类为线程安全
+        #队列有最大长度，下载线程跟不上时URL生产者会等待
+        self.work_queue = frontier.HostFrontier(config.frontier_rate_per_host, config.frontier_burst,
+                                                config.frontier_host_weights, config.work_queue_maxsize)
         self.get_url_spiders_list = []                  #下载url的蜘蛛线程对象列表
         self.get_images_spiders_list = []               #下载image的蜘蛛线程对象列表
         self.image_folder = image_folder                #保存图片的路径
         if not os.path.isdir(self.image_folder):
             os.makedirs(self.image_folder)
+        self.parts_folder = os.path.join(self.image_folder, ".parts")     #下载中的临时文件路径
+        if not os.path.isdir(self.parts_folder):
+            os.makedirs(self.parts_folder)
+        #以下为从断点抓取功能设计的属性，已发现的URL、下载状态、失败记录和页面断点都保存在crawl_state中
+        self.crawl_state = crawlstate.open_crawl_state()
+        #所有url都已抓取完成时清空记录，重新开始
+        if self.crawl_state.is_complete():
+            self.crawl_state.reset()
+
+        #所有网站共用的浏览器池，限制同时运行的浏览器数量
+        self.driver_pool = driverpool.DriverPool(config.driver_pool_max_browsers)
+
         #初始化工作线程对象
         not_download_backend_count = 0
         for i, web_class in enumerate(web_class_list):
@@ -91,7 +177,8 @@ class MasterSpider():
                 keywrods = config.keywords_english
             s = GetURLSpider(i, lambda url:self._put_url_2_spider_queue_func(url),
                             lambda url, cookies = None:self._download_and_save_url(url, cookies), web_class[0], self.dev_mode,
-                            image_folder = self.image_folder, keywrods = keywrods)
+                            image_folder = self.image_folder, keywrods = keywrods,
+                            crawl_state = self.crawl_state, driver_pool = self.driver_pool)
             self.get_url_spiders_list.append(s)
             if not s.backend:
                 not_download_backend_count += 1
@@ -99,49 +186,57 @@ class MasterSpider():
         if not_download_backend_count == len(web_class_list):
             self.worker_num = 0
 
-        for i in range(self.worker_num):
-            s = GetImageSpider(i, lambda: self._get_url_from_queue(),
-                                lambda url, cookies = None:self._download_and_save_url(url, cookies), self.image_folder)
+        if download_engine == "asyncio" and self.worker_num > 0:
+            s = asyncspider.AsyncImageSpider(0, lambda: self._get_url_from_queue(),
+                                lambda url, writer: self._save_and_record_pic(url, writer), DOWNLOAD_HEADERS,
+                                lambda url, e: self._record_download_failure(url, e),
+                                create_writer_func = lambda url: self.create_pic_writer(url),
+                                done_func = lambda url: self._task_done())
             self.get_images_spiders_list.append(s)
+        else:
+            for i in range(self.worker_num):
+                s = GetImageSpider(i, lambda: self._get_url_from_queue(),
+                                    lambda url: self._download_queued_url(url), self.image_folder)
+                self.get_images_spiders_list.append(s)
+
+        #从断点处开始抓取时，由该线程分批将未下载完成的url加入到队列中，下载线程无需等待全部入队即可开始工作
+        self.resume_feeder = threading.Thread(target = self._feed_pending_urls, daemon = True)
+        self.pending_urls = None
+        #下载失败的url按失败类型延迟重试，到期后重新放入任务队列，重试计划保存在crawl_state中
+        self.retry_queue = retryqueue.RetryQueue(self.crawl_state, lambda url: self.work_queue.put(url))
+        #已从任务队列取出但还未处理完成的url数量，用于判断是否还会产生新的重试
+        self.active_tasks = 0
+        self.active_tasks_lock = threading.Lock()
+
+        #下载时按内容去重，字节完全相同的图片只保存一次，重复的URL记录到duplicate_urls_file中
+        self.content_index = dedup.ContentHashIndex("content_hash_index.txt")
+        self.duplicate_urls_file = "duplicate_img_urls.txt"
+        self.duplicate_file_lock = threading.Lock()
 
-        #TODO:后期考虑使用数据库组件，从而在保存断点和历史数据时更有效率
-        #以下为从断点抓取功能设计的属性
-        self.all_urls_file = "all_img_urls.txt"
-        self.downloaded_urls_file = "downloaded_img_urls.txt"           #抓取成功url历史记录文件
-        #不允许all_urls_file不存在但是downloaded_urls_file存在的情况
-        assert os.path.exists(self.all_urls_file) or not os.path.exists(self.downloaded_urls_file),\
-                 "all_img_urls.txt not found but downloaded_img_urls.txt found"
-
-        self.all_file_lock = threading.Lock()                           #所有url文件锁
-        self.all_urls_set = set()
-        if os.path.exists(self.all_urls_file):
-            with open(self.all_urls_file) as f:
-                self.all_urls_set = {line.strip() for line in f.readlines()}
-        #将文件中所有url加入到队列中，从而达到从断点处开始抓取机制
-        if len(self.all_urls_set):
-            for url in self.all_urls_set:
-                self.work_queue.put(url)
-
-        self.downloaded_file_lock = threading.Lock()                    #抓取成功url历史文件写入锁
-        self.downloaded_urls_set = set()
-        if os.path.exists(self.downloaded_urls_file):
-            with open(self.downloaded_urls_file) as f:
-                self.downloaded_urls_set = {line.strip() for line in f.readlines()}
-        #比对所有url集合和已抓取url，如果内容相等，说明所有内容都抓取完成，这些文件都可删除
-        if len(self.all_urls_set) > 0 and len(self.downloaded_urls_set) > 0 \
-            and self.all_urls_set == self.downloaded_urls_set:
-            os.remove(self.all_urls_file)
-            os.remove(self.downloaded_urls_file)
-            self.all_urls_set = set()
-            self.downloaded_urls_set = set()
+        #每个下载线程持有一个长连接Session，复用同一主机的连接
+        self.http_sessions = httpclient.ThreadLocalSessions(DOWNLOAD_HEADERS)
+
+        metrics.QUEUE_DEPTH.set_function(self.work_queue.qsize)
+        metrics.RETRY_QUEUE_DEPTH.set_function(lambda: len(self.retry_queue))
+        self.metrics_server = None
+        self.metrics_writer = None
 
         random.seed(time.time())
+        #爬取状态和内容去重索引读取完成
+        self._take_mem_snapshot("state-loaded")
 
     def start(self):
         '''
         Description: 开始干活
         '''
         logging.info("爬虫开始运行...")
+        self._start_metrics()
+        #没有后台下载线程时，放入队列的url不会被取出，队列满后会一直阻塞
+        if self.worker_num > 0:
+            #在URL线程开始前获取未下载url的快照，之后新发现的url由URL线程放入队列，不会被重复放入
+            self.pending_urls = self.crawl_state.iter_pending()
+            self.resume_feeder.start()
+            self.retry_queue.start()
         for s in self.get_url_spiders_list:
             s.start()
         for s in self.get_images_spiders_list:
@@ -149,17 +244,60 @@ class MasterSpider():
         #等待素有URL线程退出
         for s in self.get_url_spiders_list:
             s.join()
+        if self.resume_feeder.is_alive():
+            self.resume_feeder.join()
         logging.debug("所有获取URL线程全部退出")
-        #任务爬取完成，停止Image线程
+        self.driver_pool.close()
+        self._take_mem_snapshot("discovery-done")
+        if self.worker_num > 0:
+            self._wait_for_due_retries()
+        #任务爬取完成，关闭队列，Image线程取完队列中剩余的url后退出
+        self.work_queue.close()
         for s in self.get_images_spiders_list:
-            s.stop()
             s.join()
+        #超过config.retry_drain_wait秒才到期的重试已保存在crawl_state中，推迟到下次运行时重试
+        self.retry_queue.close()
+        if len(self.retry_queue) > 0:
+            logging.info("%d个url推迟到下次运行时重试" % (len(self.retry_queue)))
         logging.info("所有网站爬取完成")
+        self._take_mem_snapshot("download-done")
+        self.http_sessions.close()
+        self.crawl_state.close()
+        self._stop_metrics()
 
         #self._remove_redundant_img()
 
+        if self.mem_profiler is not None:
+            self.mem_profiler.close()
         logging.info("所有任务完成，程序退出")
 
+    def _take_mem_snapshot(self, label):
+        '''
+        Description: 开启内存分析时，在阶段结束后获取一次内存快照
+        '''
+        if self.mem_profiler is not None:
+            self.mem_profiler.take_snapshot(label)
+
+    def _start_metrics(self):
+        '''
+        Description: 根据配置启动监控指标HTTP服务和JSON快照线程
+        '''
+        if config.metrics_port is not None:
+            try:
+                self.metrics_server = metrics.start_http_server(config.metrics_port, config.metrics_host)
+            except OSError as e:
+                logging.error("监控指标HTTP服务启动失败，端口: %d, %s" % (config.metrics_port, e))
+        if config.metrics_snapshot_file:
+            self.metrics_writer = metrics.SnapshotWriter(config.metrics_snapshot_file, config.metrics_snapshot_interval)
+            self.metrics_writer.start()
+
+    def _stop_metrics(self):
+        if self.metrics_writer is not None:
+            self.metrics_writer.close()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+
     def _remove_redundant_img(self):
         logging.info("开始进行去重")
         cur_dir = os.path.abspath(".")
@@ -169,125 +307,386 @@ class MasterSpider():
             os.mkdir(removed_imgs_folder)
 
         imgs_list = [img for img in os.listdir() if os.path.isfile(img)]
-        for i  in range(len(imgs_list) - 1):
-            for img in imgs_list[i+1:]:
-                if utils.compute_similarity_by_rgb_hist(imgs_list[i], img) > 0.95:
-                    #此处并未删除文件，而是将重复文件移动到另外的文件夹，从而需使用者确认后手动删除
-                    shutil.move(imgs_list[i], removed_imgs_folder)
-                    break
+        #特征保存在图片文件夹下的隐藏目录中，增量去重时只需为新图片提取特征
+        store = featurestore.FeatureStore(".feature_store")
+        #图片解码和特征提取在进程池中进行，特征比较在当前进程中进行
+        extract_func = lambda paths: featurestore.extract_features_parallel(paths,
+                                        config.dedup_worker_num, config.dedup_chunk_size)
+        for img in dedup.find_redundant_imgs_in_store(imgs_list, store, config.dedup_method,
+                                                        config.dedup_similarity, extract_func):
+            #此处并未删除文件，而是将重复文件移动到另外的文件夹，从而需使用者确认后手动删除
+            shutil.move(img, removed_imgs_folder)
 
         os.chdir(cur_dir)
         logging.info("去重完成，退出")
 
+    def _feed_pending_urls(self):
+        '''
+        Description: 计算一次未下载完成的url，并按config.resume_chunk_size分批放入队列，
+                队列中的url都未下载过，下载线程取出后不需要再判断
+        '''
+        count = 0
+        chunk = []
+        for url in self.pending_urls:
+            chunk.append(url)
+            if len(chunk) >= config.resume_chunk_size:
+                self.work_queue.put_many(chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            self.work_queue.put_many(chunk)
+            count += len(chunk)
+        logging.info("从断点恢复%d个未下载的url" % (count))
+
     def _get_url_from_queue(self):
         '''
-        从队列中获取URL任务
+        从队列中获取URL任务，队列为空时阻塞，队列关闭并且所有任务都已分发时返回None
         '''
-        try:
-            url = self.work_queue.get(timeout = 2)
-        except queue.Empty as e:
-            return None
-        self.downloaded_file_lock.acquire()
-        if url in self.downloaded_urls_set:
-            url = None
-        self.downloaded_file_lock.release()
+        url = self.work_queue.get()
+        if url is not None:
+            with self.active_tasks_lock:
+                self.active_tasks += 1
         return url
 
+    def _task_done(self):
+        with self.active_tasks_lock:
+            self.active_tasks -= 1
+
+    def _download_queued_url(self, url):
+        try:
+            self._download_and_save_url(url)
+        finally:
+            self._task_done()
+
+    def _wait_for_due_retries(self):
+        '''
+        Description: 所有URL都已发现后，等待任务队列中的url下载完成，并等待config.retry_drain_wait秒内到期的重试，
+                否则下载线程在任务队列取空后立即退出，本次运行中之后到期的重试都不会执行
+        '''
+        while True:
+            with self.active_tasks_lock:
+                active_tasks = self.active_tasks
+            if active_tasks == 0 and self.work_queue.qsize() == 0 and \
+                    not self.retry_queue.has_due_within(config.retry_drain_wait):
+                return
+            time.sleep(0.2)
+
     def _put_url_2_spider_queue_func(self, url):
         '''
         将URL放入到爬虫任务队列中
         '''
-        self.all_file_lock.acquire()
         #重复任务不再入队列
-        if url in self.all_urls_set:
-            self.all_file_lock.release()
-            return
-        with open(self.all_urls_file, "a") as f:
-            f.write(url+"\n")
-        self.all_urls_set.add(url)
-        self.all_file_lock.release()
-        self.work_queue.put(url)
+        if self.crawl_state.add_url(url):
+            metrics.URLS_QUEUED.inc()
+            self.work_queue.put(url)
 
     def write_succ_url(self, url):
-        self.downloaded_file_lock.acquire()
-        with open(self.downloaded_urls_file, "a") as f:
-            f.write(url+"\n")
-        self.downloaded_urls_set.add(url)
-        self.downloaded_file_lock.release()
+        self.crawl_state.mark_downloaded(url)
+        self.retry_queue.record_success(url)
+        metrics.DOWNLOADS.inc()
+
+    def write_duplicate_url(self, url, file_name):
+        '''
+        Description: 记录内容与已保存文件完全相同的图片URL
+        '''
+        metrics.DUPLICATES.inc()
+        with self.duplicate_file_lock:
+            with open(self.duplicate_urls_file, "a") as f:
+                f.write("%s\t%s\n" % (url, file_name))
+
+    def _record_download_failure(self, url, e):
+        '''
+        Description: 记录下载失败，可重试的失败由retry_queue延迟后重新放入队列
+        '''
+        kind = classify_download_error(e)
+        metrics.DOWNLOAD_FAILURES.inc(kind = kind)
+        logging.error(u'%s  %s下载失败(%s):%s' % (time.ctime(), url, kind, e))
+        self.retry_queue.record_failure(url, kind)
 
     def _download_and_save_url(self, url, cookies = None):
-        if self._download_pic(url, cookies):
-            #将下载成功的URL加入到已下载URL集合中
-            self.write_succ_url(url)
+        start = time.monotonic()
+        metrics.DOWNLOADS_INFLIGHT.inc()
+        try:
+            self._download_pic(url, cookies)
+        except Exception as e:
+            self._record_download_failure(url, e)
+            return
+        finally:
+            metrics.DOWNLOADS_INFLIGHT.dec()
+        metrics.DOWNLOAD_SECONDS.observe(time.monotonic() - start)
+        #将下载成功的URL加入到已下载URL集合中
+        self.write_succ_url(url)
 
     def _create_file_name(self, file_ext):
         '''
-        Description: 按照格式创建唯一的图片文件名
+        Description: 按照格式创建唯一的图片文件名，并以独占方式创建同名的空文件占用该文件名，
+                多个下载线程同一秒内生成相同文件名时重新生成，从而不会覆盖已保存的图片
         Args: 
             file_ext：文件格式后缀，如jpg,png等
         Returns:
-            返回保存文件的绝对路径
+            返回保存文件的绝对路径，调用者应使用os.replace将图片移动到该路径
         '''
-        localtime = time.localtime()
-        randint = random.randint(1, 1000)
-        #图片本地保存格式: "year-month-day-hour-minutes-seconds-randint"+文件格式后缀
-        file_name = "%d-%d-%d-%d-%d-%d.%s" % (localtime.tm_year, localtime.tm_mon, localtime.tm_mday, localtime.tm_hour,
-                                                localtime.tm_min, localtime.tm_sec, file_ext)
-        return os.path.join(self.image_folder, file_name) 
+        while True:
+            localtime = time.localtime()
+            randint = random.randint(1, 1000)
+            #图片本地保存格式: "year-month-day-hour-minutes-seconds-randint"+文件格式后缀
+            file_name = "%d-%d-%d-%d-%d-%d-%d.%s" % (localtime.tm_year, localtime.tm_mon, localtime.tm_mday, localtime.tm_hour,
+                                                    localtime.tm_min, localtime.tm_sec, randint, file_ext)
+            file_name = os.path.join(self.image_folder, file_name)
+            try:
+                fd = os.open(file_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            os.close(fd)
+            return file_name
+
+    def _get_part_file(self, url):
+        '''
+        Description: 获取url对应的未完成下载文件路径，同一url每次得到的路径相同，从而可在重试或重启后续传
+        '''
+        return os.path.join(self.parts_folder, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".part")
+
+    def _remove_part_file(self, part_file):
+        for file_name in [part_file, part_file + ".meta"]:
+            if os.path.exists(file_name):
+                os.remove(file_name)
 
     def _download_pic(self, url, cookies = None):
         '''
-        Description: 根据图片url下载图片数据，并保存在指定文件夹
+        Description: 根据图片url以流的方式下载图片数据，并保存在指定文件夹，已下载的部分保存在.part文件中，
+                超时或连接中断后使用Range请求从断点继续下载，服务器不支持Range时重新下载
         Args: 
             url: 图片url
-        Returns:
-            True:下载成功，False下载失败
+        Raises:
+            retryqueue.DownloadError: 状态码错误、图片数据无效或续传次数用完
+            requests.exceptions.RequestException: 超时、连接错误等网络异常
+        '''
+        jar = None
+        if cookies:
+            jar = requests.cookies.RequestsCookieJar()
+
+            for cookie in cookies:
+                jar.set(cookie["name"], cookie["value"], domain = cookie["domain"], secure = cookie["secure"],
+                    expiry = cookie["expiry"], httpOnly = cookie["httpOnly"], path = cookie["path"])
+
+        # req = urllib.request.Request(url=url, headers = self.headers)
+        # with urllib.request.urlopen(req, timeout=30) as img_req:
+        #     data = img_req.read()
+        part_file = self._get_part_file(url)
+        for _ in range(config.download_resume_attempts):
+            offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+            headers = {}
+            if offset > 0:
+                headers["Range"] = "bytes=%d-" % (offset)
+                #资源发生变化时服务器会返回完整内容
+                if os.path.exists(part_file + ".meta"):
+                    with open(part_file + ".meta") as f:
+                        validator = f.read().strip()
+                    if validator:
+                        headers["If-Range"] = validator
+            try:
+                with self.http_sessions.get().get(url, timeout = config.download_timeout, allow_redirects = True,
+                                                    cookies = jar, headers = headers, stream = True) as img_req:
+                    if img_req.status_code == 416 and offset > 0:
+                        #断点位置无效，删除后重新下载
+                        self._remove_part_file(part_file)
+                        continue
+                    resume = offset > 0 and img_req.status_code == 206 and \
+                            img_req.headers.get("Content-Range", "").startswith("bytes %d-" % (offset))
+                    if offset > 0 and not resume and img_req.status_code != 200:
+                        #续传请求得到不匹配的206或其他状态码，已下载的部分不再可信，删除后从头下载
+                        logging.info("%s 续传失败(status code: %d)，重新下载" % (url, img_req.status_code))
+                        self._remove_part_file(part_file)
+                        continue
+                    if img_req.status_code != 200 and not resume:
+                        raise retryqueue.DownloadError(retryqueue.classify_http_status(img_req.status_code),
+                                                        "status code: %d" % (img_req.status_code))
+                    content_length = int(img_req.headers.get("Content-Length", 0) or 0)
+                    if (offset if resume else 0) + content_length > config.download_max_size:
+                        self._remove_part_file(part_file)
+                        raise retryqueue.DownloadError(retryqueue.FAIL_TOO_LARGE, "图片过大: %d字节" % (content_length))
+                    if not resume:
+                        validator = img_req.headers.get("ETag") or img_req.headers.get("Last-Modified") or ""
+                        with open(part_file + ".meta", "w") as f:
+                            f.write(validator)
+                    try:
+                        self._save_pic_stream(url, img_req.iter_content(config.download_chunk_size),
+                                                part_file, resume)
+                    finally:
+                        if not os.path.exists(part_file):
+                            self._remove_part_file(part_file)
+                    return
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                #本次没有下载到任何数据时不再重试
+                if not os.path.exists(part_file) or os.path.getsize(part_file) <= offset:
+                    raise
+                logging.info("%s 下载中断，已下载%d字节，继续下载: %s" % (url, os.path.getsize(part_file), e))
+        raise retryqueue.DownloadError(retryqueue.FAIL_CONNECTION,
+                                        "续传%d次后仍未完成" % (config.download_resume_attempts))
+
+    def _scan_part_file(self, part_file):
+        '''
+        Description: 读取未完成下载文件，计算续传所需的文件头、大小和CRC32
+        '''
+        head = b""
+        size = 0
+        crc = 0
+        with open(part_file, "rb") as f:
+            for chunk in iter(lambda: f.read(config.download_chunk_size), b""):
+                if len(head) < SNIFF_SIZE:
+                    head += chunk[:SNIFF_SIZE - len(head)]
+                size += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+        return head, size, crc
+
+    def _save_pic_stream(self, url, chunks, part_file = None, resume = False):
+        '''
+        Description: 将图片数据块写入临时文件，文件头达到SNIFF_SIZE字节时即判断图片格式，不是图片
+                或者大小超过config.download_max_size时立即放弃，下载完成后再移动到图片文件夹，
+                内存占用与图片大小无关
+        Args:
+            url: 图片url
+            chunks: 可迭代的图片数据块
+            part_file: 未完成下载文件路径，数据块中断时保留该文件以便续传，为None时使用临时文件
+            resume: 是否将数据块追加到part_file已有内容之后
+        Raises:
+            retryqueue.DownloadError: 图片数据无效或过大
         '''
+        writer = self.create_pic_writer(url, part_file, resume)
+        discard = True
         try:
-            #使用与浏览器相同的header，防止网站反爬虫机制
-            headers={
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,'\
-                                'image/webp,image/apng,*/*;q=0.8',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'Accept-Language': 'zh-CN,zh;q=0.9',
-#                    'Cache-Control': 'max-age=0',
-                    'Connection': 'keep-alive',
-#                    'Upgrade-Insecure-Requests': '1',
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '\
-                                    '(KHTML, like Gecko) Chrome/71.0.3578.98 Safari/537.36'}
-            if cookies:
-                jar = requests.cookies.RequestsCookieJar()
-
-                for cookie in cookies:
-                    jar.set(cookie["name"], cookie["value"], domain = cookie["domain"], secure = cookie["secure"],
-                        expiry = cookie["expiry"], httpOnly = cookie["httpOnly"], path = cookie["path"])
-
-            # req = urllib.request.Request(url=url, headers = self.headers)
-            # with urllib.request.urlopen(req, timeout=30) as img_req:
-            #     data = img_req.read()
-                img_req = requests.get(url, timeout = 10, headers = headers, 
-                                        allow_redirects = True, cookies=jar)
-            else:
-                img_req = requests.get(url, timeout = 10, headers = headers, allow_redirects = True)
-            if img_req.status_code != 200:
-                logging.error("%s 请求出错, status code: %d" % (url, img_req.status_code))
-                return False
-            data = img_req.content
-            if len(data) == 0:
-                return False
-            #获取文件格式
-            file_ext = imghdr.what("", h = data)
-            if file_ext is None:
-                logging.error("%s 未知的图片格式" % (url))
-                return False
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.finish()
+        except retryqueue.DownloadError:
+            raise
+        except Exception:
+            #数据传输中断时保留已下载的部分
+            discard = part_file is None
+            raise
+        finally:
+            writer.close(discard)
+
+    def create_pic_writer(self, url, part_file = None, resume = False):
+        '''
+        Description: 创建将图片数据块写入临时文件的PicPartWriter，各下载引擎共用
+        Args:
+            part_file: 未完成下载文件路径，为None时在.parts文件夹中创建临时文件
+            resume: 是否将数据块追加到part_file已有内容之后
+        '''
+        if part_file is None:
+            fd, part_file = tempfile.mkstemp(suffix = ".part", dir = self.parts_folder)
+            os.close(fd)
+        try:
+            return PicPartWriter(self, url, part_file, resume)
+        except retryqueue.DownloadError:
+            #已下载的部分不是图片，不再续传
+            os.remove(part_file)
+            raise
+
+    def _store_part_file(self, url, part_file, size, crc, file_ext):
+        '''
+        Description: 将下载完成的临时文件移动到图片文件夹，与已保存图片内容完全相同时不再重复写入
+        '''
+        metrics.DOWNLOAD_BYTES.inc(size)
+        def store():
             file_name = self._create_file_name(file_ext)
-            with open(file_name, 'wb') as f:
-                f.write(data)
+            try:
+                os.replace(part_file, file_name)
+            except OSError:
+                os.remove(file_name)
+                raise
+            return file_name
+
+        #查找和保存是一个原子操作，同时下载到相同内容的线程能找到先保存的文件
+        exist_file, stored = self.content_index.find_or_store((size, crc), part_file, store)
+        if not stored:
+            logging.info("%s 与已保存图片 %s 内容相同" % (url, exist_file))
+            self.write_duplicate_url(url, exist_file)
+
+    def _save_and_record_pic(self, url, writer):
+        '''
+        Description: 完成其他下载引擎通过create_pic_writer写入的图片，成功后记录URL，
+                无论成功与否都会删除临时文件
+        Returns:
+            True:保存成功，False保存失败
+        '''
+        try:
+            writer.finish()
         except Exception as e:
-            logging.error(u'%s  %s请求出错:%s' % (time.ctime(), url, e))
+            self._record_download_failure(url, e)
             return False
+        finally:
+            writer.close(True)
+        self.write_succ_url(url)
         return True
 
+class PicPartWriter():
+    '''
+    将一张图片的数据块依次写入临时文件，同时计算大小和CRC32，并在文件头达到SNIFF_SIZE字节时判断图片格式
+    '''
+    def __init__(self, master_spider, url, part_file, resume = False):
+        self.master_spider = master_spider
+        self.url = url
+        self.part_file = part_file
+        self.head = b""
+        self.size = 0
+        self.crc = 0
+        self.file_ext = None
+        if resume:
+            self.head, self.size, self.crc = master_spider._scan_part_file(part_file)
+            self._check_head()
+        self.f = open(part_file, "ab" if resume else "wb")
+
+    def _check_head(self):
+        if self.file_ext is None and len(self.head) >= SNIFF_SIZE:
+            self.file_ext = imghdr.what("", h = self.head)
+            if self.file_ext is None:
+                raise retryqueue.DownloadError(retryqueue.FAIL_NOT_IMAGE, "未知的图片格式")
+
+    def write(self, chunk):
+        '''
+        Raises:
+            retryqueue.DownloadError: 不是图片或大小超过config.download_max_size
+        '''
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > config.download_max_size:
+            raise retryqueue.DownloadError(retryqueue.FAIL_TOO_LARGE,
+                                            "图片过大: 超过%d字节" % (config.download_max_size))
+        self.crc = zlib.crc32(chunk, self.crc)
+        self.f.write(chunk)
+        if len(self.head) < SNIFF_SIZE:
+            #获取文件格式
+            self.head += chunk[:SNIFF_SIZE - len(self.head)]
+            self._check_head()
+
+    def finish(self):
+        '''
+        Description: 所有数据块写入后调用，检查图片数据并保存到图片文件夹
+        Raises:
+            retryqueue.DownloadError: 图片数据无效
+        '''
+        self.f.close()
+        if self.size == 0:
+            raise retryqueue.DownloadError(retryqueue.FAIL_NOT_IMAGE, "图片数据为空")
+        if self.file_ext is None:
+            #图片小于SNIFF_SIZE字节
+            self.file_ext = imghdr.what("", h = self.head)
+            if self.file_ext is None:
+                raise retryqueue.DownloadError(retryqueue.FAIL_NOT_IMAGE, "未知的图片格式")
+        self.master_spider._store_part_file(self.url, self.part_file, self.size, self.crc, self.file_ext)
+
+    def close(self, discard = True):
+        '''
+        Description: 关闭临时文件，discard为True时删除未移动到图片文件夹的临时文件
+        '''
+        self.f.close()
+        if discard and os.path.exists(self.part_file):
+            os.remove(self.part_file)
+
 if __name__ == "__main__":
     import test_urls
 
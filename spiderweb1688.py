@@ -7,9 +7,13 @@ import logging
 from selenium import webdriver
 import selenium.common.exceptions as exception
 from basespiderweb import BaseSpiderWeb
-import time
 
 class SpiderWeb1688(BaseSpiderWeb):
+    #搜索结果中每个商品进入详细页面的链接
+    abstract_url_rules = [("li.sm-offer-item.sw-dpl-offer-item > div > div > a", "href")]
+    #详细页面中商品描述的图片
+    detail_img_rules = [("#mod-detail-description img", "src")]
+
     def __init__(self, put_url_2_queue_func, get_img_func = None, dev_mode = True,
                     image_folder = ".", keywrods = ""):
         BaseSpiderWeb.__init__(self, "1688", "https://www.1688.com/",
@@ -72,14 +76,12 @@ class SpiderWeb1688(BaseSpiderWeb):
     def scroll_slider(self):
         js="window.scrollBy(0, 1000)"
         img_page_count = 0
-        #TODO:是否有更好的方式确定所有内容已经加载完成
         while True:
             self.driver.execute_script(js)
-            time.sleep(5)
-            image_items = self.driver.find_elements_by_css_selector("li.sm-offer-item.sw-dpl-offer-item")
-            if len(image_items) <= img_page_count:
+            count = self.wait_for_load("li.sm-offer-item.sw-dpl-offer-item", img_page_count)
+            if count <= img_page_count:
                 break
-            img_page_count = len(image_items)
+            img_page_count = count
 
     def goto_next_page(self):
         try:
@@ -96,31 +98,6 @@ class SpiderWeb1688(BaseSpiderWeb):
         next_btn.click()
         return True
 
-    def get_abstract_urls_this_page(self):
-        '''
-        Description: 大部分图片网站搜索后显示的都是当前页图片的缩略图，只有根据缩略图链接进入到新的页面才能
-                拿到图片的原图URL，本方法就是获取本页面所有进入详细页面的URL,
-        Returns: 
-            urls: 从当前页面上获取的缩略图URL
-            None: 未获取到任何图片URL
-        '''
-        try:
-            items = self.driver.find_elements_by_css_selector("li.sm-offer-item.sw-dpl-offer-item")
-        except exception.NoSuchElementException as e:
-            logging.error("%s : %s" %(self.name, "没有弹窗，继续"))
-            return None
-
-        urls = []
-        for item in items:
-            try:
-                a = item.find_element_by_xpath("div/div/a")
-                url = a.get_attribute("href")
-                urls.append(url)
-            except exception.NoSuchElementException as e:
-                logging.info("%s : %s" %(self.name, e))
-        
-        return urls
-
     def iterate_all_url(self, urls):
         '''
         Description: 1688的特殊性，此处重载该方法
@@ -129,6 +106,9 @@ class SpiderWeb1688(BaseSpiderWeb):
         '''
         if urls is None:
             return
+        #有可用的工作浏览器时并行打开详细页面
+        if self.resolve_detail_pages_parallel(urls):
+            return
 
         #新开一个窗口
         js = 'window.open("");'
@@ -136,19 +116,12 @@ class SpiderWeb1688(BaseSpiderWeb):
         self.driver.switch_to_window(self.driver.window_handles[-1])
         for url in urls:
             try:
-                self.driver.get(url)
-                orig_urls = self.get_original_img_url(url)
+                orig_urls = self.resolve_detail_page(url)
 
                 if orig_urls is None:
                     logging.error("%s, 当前缩略页面%s页面对应的原图url为None" % (self.name, url))
                     continue
-                for url in orig_urls:
-                    if self.download_backend:
-                        #将图片url传给后台下载
-                        self.put_url_2_queue_func(url)
-                    else:
-                        #直接下载图片
-                        self.get_img(url, self.driver.get_cookies())
+                self.deliver_urls(orig_urls, self.driver.get_cookies())
             except Exception as e:
                 logging.error("%s : %s" %(self.name, e))
         self.driver.close()
@@ -157,27 +130,22 @@ class SpiderWeb1688(BaseSpiderWeb):
     def scroll_slider_in_detail_page(self):
         js="window.scrollBy(0, 1500)"
         img_count = -1
-        #TODO:是否有更好的方式确定所有内容已经加载完成
         while True:
+            #每次滚动两屏，避免中间的文字区域没有触发图片加载而提前结束
             self.driver.execute_script(js)
-            time.sleep(3)
+            count = self.wait_for_load("#mod-detail-description img", img_count)
             self.driver.execute_script(js)
-            time.sleep(3)
-            detail = self.driver.find_element_by_id("mod-detail-description")
-            img = detail.find_elements_by_tag_name("img")
-            if img_count == len(img):
+            count = self.wait_for_load("#mod-detail-description img", count)
+            if img_count == count:
                 break
-            img_count = len(img)
+            img_count = count
+
+    def resolve_detail_page(self, url):
+        self.driver.get(url)
+        return self.get_original_img_url(url)
 
     def get_original_img_url(self, url = None):
         #详细页面也有懒加载
         self.scroll_slider_in_detail_page()
-        urls = []
-        try:
-            detail = self.driver.find_element_by_id("mod-detail-description")
-            img_items = detail.find_elements_by_tag_name("img")
-            urls = [item.get_attribute("src") for item in img_items]
-        except exception.NoSuchElementException as e:
-                logging.info("%s : %s" %(self.name, e))
-        return urls
+        return self.extract_urls(self.detail_img_rules)
 
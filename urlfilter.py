@@ -0,0 +1,146 @@
+'''
+本文件实现了占用内存有限的URL集合，用于替代超大规模抓取时保存完整URL字符串的set，
+使用可扩展的布隆过滤器（Scalable Bloom Filter），误判率可配置，误判时表现为把新URL当作已存在的URL，
+过滤器持久化保存在日志文件旁边，并记录已覆盖的日志文件长度，启动时只需重放之后新增的记录
+'''
+import hashlib
+import logging
+import math
+import os
+import struct
+
+_FILE_MAGIC = b"ISBLOOM1"
+_HEADER = struct.Struct("<8sQI")                #魔数、已覆盖的日志文件字节数、子过滤器数量
+_FILTER_HEADER = struct.Struct("<QdQQI")        #容量、误判率、元素个数、位数、哈希函数个数
+
+def _hash_pair(item):
+    digest = hashlib.blake2b(item.encode("utf-8"), digest_size = 16).digest()
+    h1, h2 = struct.unpack("<QQ", digest)
+    return h1, h2 | 1
+
+class BloomFilter():
+    '''
+    固定容量的布隆过滤器，使用双重哈希生成k个位置
+    '''
+    def __init__(self, capacity, error_rate, count = 0, num_bits = None, num_hashes = None, bits = None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = count
+        self.num_bits = num_bits or max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = num_hashes or max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, h1, h2):
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def contains_hash(self, h1, h2):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(h1, h2))
+
+    def add_hash(self, h1, h2):
+        bits = self.bits
+        for pos in self._positions(h1, h2):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+class ScalableBloomFilter():
+    '''
+    可扩展的布隆过滤器，当前子过滤器满时新建一个容量翻倍、误判率减半的子过滤器，
+    从而总体误判率不超过error_rate，接口与set的add、in和len保持一致
+    '''
+    def __init__(self, initial_capacity = 1000000, error_rate = 0.001):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.filters = []
+        self.journal_offset = 0             #过滤器已覆盖的日志文件字节数
+
+    def __contains__(self, item):
+        h1, h2 = _hash_pair(item)
+        return any(f.contains_hash(h1, h2) for f in self.filters)
+
+    def add(self, item):
+        '''
+        Description: 添加元素
+        Returns:
+            True: 新元素，False: 元素可能已存在
+        '''
+        h1, h2 = _hash_pair(item)
+        if any(f.contains_hash(h1, h2) for f in self.filters):
+            return False
+        if not self.filters or self.filters[-1].is_full():
+            #各子过滤器误判率按0.5的比例递减，总和不超过error_rate
+            index = len(self.filters)
+            self.filters.append(BloomFilter(self.initial_capacity * (2 ** index),
+                                            self.error_rate * (0.5 ** (index + 1))))
+        self.filters[-1].add_hash(h1, h2)
+        return True
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    def save(self, file_name):
+        '''
+        Description: 以原子替换的方式将过滤器保存到文件
+        '''
+        tmp_file = file_name + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(_HEADER.pack(_FILE_MAGIC, self.journal_offset, len(self.filters)))
+            for bf in self.filters:
+                f.write(_FILTER_HEADER.pack(bf.capacity, bf.error_rate, bf.count, bf.num_bits, bf.num_hashes))
+                f.write(bf.bits)
+        os.replace(tmp_file, file_name)
+
+    @classmethod
+    def load(cls, file_name, initial_capacity = 1000000, error_rate = 0.001):
+        '''
+        Description: 从文件读取过滤器，文件不存在或已损坏时返回None
+        '''
+        try:
+            with open(file_name, "rb") as f:
+                magic, journal_offset, num_filters = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != _FILE_MAGIC:
+                    return None
+                sbf = cls(initial_capacity, error_rate)
+                sbf.journal_offset = journal_offset
+                for _ in range(num_filters):
+                    capacity, rate, count, num_bits, num_hashes = _FILTER_HEADER.unpack(f.read(_FILTER_HEADER.size))
+                    bits = bytearray(f.read((num_bits + 7) // 8))
+                    if len(bits) != (num_bits + 7) // 8:
+                        return None
+                    sbf.filters.append(BloomFilter(capacity, rate, count, num_bits, num_hashes, bits))
+                return sbf
+        except (OSError, struct.error) as e:
+            logging.error("读取布隆过滤器文件 %s 出错: %s" % (file_name, e))
+            return None
+
+def load_url_filter(journal_file, filter_file, initial_capacity = 1000000, error_rate = 0.001):
+    '''
+    Description: 读取日志文件对应的过滤器，并重放过滤器保存之后日志文件中新增的URL，
+            过滤器文件不存在、已损坏或与日志文件不一致时根据日志文件重新建立
+    Args:
+        journal_file: URL日志文件，每行一个URL
+        filter_file: 过滤器文件
+    Returns:
+        ScalableBloomFilter对象
+    '''
+    journal_size = os.path.getsize(journal_file) if os.path.exists(journal_file) else 0
+    sbf = None
+    if os.path.exists(filter_file):
+        sbf = ScalableBloomFilter.load(filter_file, initial_capacity, error_rate)
+        if sbf is not None and sbf.journal_offset > journal_size:
+            logging.info("布隆过滤器 %s 与日志文件不一致，重新建立" % (filter_file))
+            sbf = None
+    if sbf is None:
+        sbf = ScalableBloomFilter(initial_capacity, error_rate)
+    if journal_size > sbf.journal_offset:
+        with open(journal_file, "rb") as f:
+            f.seek(sbf.journal_offset)
+            for line in f:
+                url = line.decode("utf-8").strip()
+                if url:
+                    sbf.add(url)
+    sbf.journal_offset = journal_size
+    return sbf
@@ -4,21 +4,115 @@
 import numpy as np
 import cv2 as cv
 
-def _calculate(image1, image2): 
+#批量计算相似度时，每个分块中参与广播计算的最大元素个数，用于限制内存占用
+_BATCH_BLOCK_ELEMENTS = 1 << 24
+
+def _overlap(hist1, hist2, axis = -1):
+    '''
+    Description: 按bin计算直方图的重合度并在axis上求平均，与原逐bin循环公式一致:
+            相等的bin记为1，否则记为1 - |h1 - h2| / max(h1, h2)
+    '''
+    diff = np.abs(hist1 - hist2)
+    peak = np.maximum(hist1, hist2)
+    #两者都为0时diff也为0，此时该bin的重合度为1
+    degree = 1 - np.divide(diff, peak, out = np.zeros_like(diff), where = peak > 0)
+    return degree.mean(axis = axis)
+
+def _calculate(image1, image2):
     '''
     Description: 计算单个通道的相似度
     '''
-    hist1 = cv.calcHist([image1],[0],None,[256],[0.0,255.0]) 
-    hist2 = cv.calcHist([image2],[0],None,[256],[0.0,255.0]) 
-    # 计算直方图的重合度 
-    degree = 0 
-    for i in range(len(hist1)): 
-        if hist1[i] != hist2[i]: 
-            degree = degree + (1 - abs(hist1[i]-hist2[i])/max(hist1[i],hist2[i])) 
-        else: 
-            degree = degree + 1 
-    degree = degree/len(hist1) 
-    return degree
+    hist1 = cv.calcHist([image1],[0],None,[256],[0.0,255.0]).ravel()
+    hist2 = cv.calcHist([image2],[0],None,[256],[0.0,255.0]).ravel()
+    # 计算直方图的重合度
+    return float(_overlap(hist1, hist2))
+
+def compute_rgb_hist(img):
+    '''
+    Description: 计算已解码图像每个通道的直方图
+    Args:
+        img: cv.imread返回的图像数据
+    Return:
+        形状为(3, 256)的float32数组
+    '''
+    return np.stack([cv.calcHist([channel],[0],None,[256],[0.0,255.0]).ravel()
+                        for channel in cv.split(img)]).astype(np.float32)
+
+def compute_rgb_hist_by_path(img_path):
+    '''
+    Description: 读取图片并计算其RGB直方图
+    Args:
+        img_path: 图片路径
+    Return:
+        形状为(3, 256)的float32数组，图片无法读取时返回None
+    '''
+    img = cv.imread(img_path)
+    if img is None:
+        return None
+    return compute_rgb_hist(img)
+
+def hist_similarity(hist1, hist2):
+    '''
+    Description: 计算两个RGB直方图的相似度
+    Args:
+        hist1, hist2: compute_rgb_hist返回的直方图
+    Return:
+        返回相似度值
+    '''
+    return float(_overlap(np.asarray(hist1, dtype = np.float32).ravel(),
+                            np.asarray(hist2, dtype = np.float32).ravel()))
+
+def batch_hist_similarity(hists, other_hists = None):
+    '''
+    Description: 批量计算直方图之间的相似度矩阵
+    Args:
+        hists: N个直方图，形状为(N, 3, 256)或(N, 768)
+        other_hists: M个直方图，为None时与hists自身比较
+    Return:
+        形状为(N, M)的float32相似度矩阵
+    '''
+    hists = np.asarray(hists, dtype = np.float32).reshape(len(hists), -1)
+    if other_hists is None:
+        other_hists = hists
+    else:
+        other_hists = np.asarray(other_hists, dtype = np.float32).reshape(len(other_hists), -1)
+    n, m = len(hists), len(other_hists)
+    result = np.empty((n, m), dtype = np.float32)
+    if n == 0 or m == 0:
+        return result
+    #按行和列分块计算，避免(N, M, 768)的中间结果占用过多内存，M很大时一行也会超过上限，因此列也要分块
+    dim = hists.shape[1]
+    col_block = max(1, min(m, _BATCH_BLOCK_ELEMENTS // dim))
+    row_block = max(1, _BATCH_BLOCK_ELEMENTS // (col_block * dim))
+    for row_start in range(0, n, row_block):
+        rows = hists[row_start:row_start + row_block, None, :]
+        for col_start in range(0, m, col_block):
+            cols = other_hists[None, col_start:col_start + col_block, :]
+            result[row_start:row_start + row_block, col_start:col_start + col_block] = _overlap(rows, cols)
+    return result
+
+def top_k_similar(hists, k, other_hists = None):
+    '''
+    Description: 批量查找每个直方图最相似的k个近邻
+    Args:
+        hists: N个直方图
+        k: 返回的近邻数量
+        other_hists: 候选直方图，为None时在hists内部查找（排除自身）
+    Return:
+        (indices, scores): 形状均为(N, k)，按相似度从高到低排列
+    '''
+    sim = batch_hist_similarity(hists, other_hists)
+    k = min(k, sim.shape[1])
+    if other_hists is None:
+        np.fill_diagonal(sim, -1)
+        k = min(k, sim.shape[1] - 1)
+    if k <= 0:
+        empty = np.empty((sim.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    indices = np.argpartition(-sim, k - 1, axis = 1)[:, :k]
+    scores = np.take_along_axis(sim, indices, axis = 1)
+    order = np.argsort(-scores, axis = 1)
+    return np.take_along_axis(indices, order, axis = 1), np.take_along_axis(scores, order, axis = 1)
 
 def compute_similarity_by_rgb_hist(img1_path, img2_path):
     '''
@@ -29,15 +123,71 @@ def compute_similarity_by_rgb_hist(img1_path, img2_path):
     Return:
         返回相似度值
     '''
-    # 将图像resize后，分离为三个通道，再计算每个通道的相似值
-    img1 = cv.imread(img1_path)
-    img2 = cv.imread(img2_path)
-    if img1 is None or img2 is None:
+    # 分离为三个通道，再计算每个通道的相似值
+    hist1 = compute_rgb_hist_by_path(img1_path)
+    hist2 = compute_rgb_hist_by_path(img2_path)
+    if hist1 is None or hist2 is None:
         return 0
-    sub_image1 = cv.split(img1) 
-    sub_image2 = cv.split(img2) 
-    sub_data = 0 
-    for im1,im2 in zip(sub_image1,sub_image2): 
-        sub_data += _calculate(im1,im2) 
-    sub_data = sub_data/3 
-    return sub_data
+    return hist_similarity(hist1, hist2)
+
+def _bits_to_int(bits):
+    '''
+    Description: 将布尔数组按行优先顺序打包为整数
+    '''
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+def compute_dhash(img, hash_size = 8):
+    '''
+    Description: 计算图像的差值哈希(dHash)，比较相邻像素的亮度变化
+    Args:
+        img: cv.imread返回的图像数据
+        hash_size: 哈希边长，哈希位数为hash_size * hash_size
+    Return:
+        哈希整数值
+    '''
+    gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    resized = cv.resize(gray, (hash_size + 1, hash_size), interpolation = cv.INTER_AREA)
+    return _bits_to_int(resized[:, 1:] > resized[:, :-1])
+
+def compute_phash(img, hash_size = 8):
+    '''
+    Description: 计算图像的感知哈希(pHash)，取DCT低频系数与其中值比较
+    Args:
+        img: cv.imread返回的图像数据
+        hash_size: 哈希边长，哈希位数为hash_size * hash_size
+    Return:
+        哈希整数值
+    '''
+    gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    size = hash_size * 4
+    resized = cv.resize(gray, (size, size), interpolation = cv.INTER_AREA).astype(np.float32)
+    low = cv.dct(resized)[:hash_size, :hash_size]
+    #直流分量代表整体亮度，不参与中值计算
+    median = np.median(low.ravel()[1:])
+    return _bits_to_int(low > median)
+
+def hamming_distance(hash1, hash2):
+    '''
+    Description: 计算两个哈希整数值的汉明距离
+    '''
+    return bin(hash1 ^ hash2).count("1")
+
+def similarity_to_distance(similarity, hash_bits = 64):
+    '''
+    Description: 将相似度阈值(0~1)换算为哈希的最大汉明距离，
+            相似度定义为1 - 汉明距离 / 哈希位数
+    '''
+    return int((1 - similarity) * hash_bits + 1e-9)
+
+def extract_features(img_path):
+    '''
+    Description: 读取图片并提取去重使用的全部特征，图片只解码一次
+    Args:
+        img_path: 图片路径
+    Return:
+        (RGB直方图, dHash, pHash)，图片无法读取时返回None
+    '''
+    img = cv.imread(img_path)
+    if img is None:
+        return None
+    return compute_rgb_hist(img), compute_dhash(img), compute_phash(img)